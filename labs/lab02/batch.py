@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Solve many Snekoban levels in parallel, and write a report of the results.
+
+Example usage:
+    python3 batch.py                             # every level in puzzles/
+    python3 batch.py --jobs 4 --timeout 30 m1_001 m2_134
+    python3 batch.py --strategy pushes --output pushes.json
+
+Each level is solved in a worker process of a process pool, under a time
+limit (in seconds) and an address-space limit (in megabytes).  The report is
+a JSON object with one record per level (solution length, the search counters
+from solve_puzzle such as states expanded and peak frontier size, wall time,
+and a status) plus a summary.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import resource
+import multiprocessing
+
+import lab
+import solution_cache
+
+LOCATION = os.path.realpath(os.path.dirname(__file__))
+PUZZLES = os.path.join(LOCATION, "puzzles")
+
+
+class LevelTimeout(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise LevelTimeout
+
+
+def limit_memory(megabytes):
+    """
+    Pool initializer: cap the address space of the worker process, so that a
+    level whose search outgrows it raises MemoryError instead of exhausting
+    the machine.
+    """
+    if megabytes:
+        limit = megabytes * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    signal.signal(signal.SIGALRM, _raise_timeout)
+
+
+def load_level(name):
+    """
+    Load the level description for the given level name (a file in puzzles/,
+    with or without the .json extension).
+    """
+    if not name.endswith(".json"):
+        name += ".json"
+    with open(os.path.join(PUZZLES, name)) as f:
+        level = json.load(f)
+    if isinstance(level, dict) and "input" in level:
+        level = level["input"]
+    return level
+
+
+def solve_level(task):
+    """
+    Solve one level in a worker process, and return its report record.
+    task is a (level name, strategy, timeout in seconds, use cache) tuple.
+    """
+    name, strategy, timeout, use_cache = task
+    record = {"level": name}
+    stats = {}
+    start = time.perf_counter()
+    if timeout:
+        signal.alarm(timeout)
+    try:
+        if use_cache:
+            solution = solution_cache.cached_solve(load_level(name), strategy, stats)
+        else:
+            solution = lab.solve_puzzle(lab.new_game(load_level(name)), stats, strategy)
+        record["status"] = "unsolvable" if solution is None else "solved"
+        record["length"] = None if solution is None else len(solution)
+    except LevelTimeout:
+        record["status"] = "timeout"
+    except MemoryError:
+        record["status"] = "memory"
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = repr(e)
+    finally:
+        signal.alarm(0)
+    record["seconds"] = time.perf_counter() - start
+    for counter in ("expanded", "generated", "duplicates", "pruned", "peak_frontier"):
+        record[counter] = stats.get(counter)
+    if use_cache:
+        record["cached"] = stats.get("cached")
+    return record
+
+
+def summarize(records, wall_time, slowest=10):
+    """
+    Build the summary part of the report: how many levels ended with each
+    status, throughput over the whole run, and the slowest levels.
+    """
+    statuses = {}
+    for record in records:
+        statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+    by_time = sorted(records, key=lambda record: record["seconds"], reverse=True)
+    return {
+        "levels": len(records),
+        "statuses": statuses,
+        "wall_time": wall_time,
+        "levels_per_second": len(records) / wall_time if wall_time else None,
+        "expanded_per_second": (
+            sum(record["expanded"] or 0 for record in records) / wall_time
+            if wall_time
+            else None
+        ),
+        "slowest": [
+            {"level": record["level"], "seconds": record["seconds"], "status": record["status"]}
+            for record in by_time[:slowest]
+        ],
+    }
+
+
+def batch_solve(names, strategy="moves", jobs=None, timeout=60, memory=None,
+                verbose=False, use_cache=False):
+    """
+    Solve the named levels with solve_puzzle across a pool of jobs processes
+    (by default, one per CPU), and return the report as a dictionary.  If
+    verbose is True, print a line as each level finishes.  If use_cache is
+    True, stored solutions are used where they are still valid (see
+    solution_cache), and new ones are stored.
+    """
+    tasks = [(name, strategy, timeout, use_cache) for name in names]
+    records = []
+    start = time.perf_counter()
+    # a fresh worker per level, so a level that hit the memory limit cannot
+    # leave a half-broken process behind for the next one
+    with multiprocessing.Pool(jobs, limit_memory, (memory,), maxtasksperchild=1) as pool:
+        for record in pool.imap_unordered(solve_level, tasks):
+            records.append(record)
+            if verbose:
+                print(f"[{len(records)}/{len(tasks)}] {record['level']}: "
+                      f"{record['status']} in {record['seconds']:.2f}s", flush=True)
+    wall_time = time.perf_counter() - start
+    records.sort(key=lambda record: record["level"])
+    return {
+        "strategy": strategy,
+        "timeout": timeout,
+        "memory": memory,
+        "results": records,
+        "summary": summarize(records, wall_time),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve Snekoban levels in parallel.")
+    parser.add_argument("--strategy", default="moves", choices=sorted(lab.solvers))
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--timeout", type=int, default=60, help="seconds allowed per level (0 for no limit)")
+    parser.add_argument("--memory", type=int, default=None, help="megabytes allowed per worker")
+    parser.add_argument("--output", default="batch_report.json")
+    parser.add_argument("--cache", action="store_true", help="reuse and store solutions in the solution cache")
+    parser.add_argument("levels", nargs="*", help="level names (default: every level in puzzles/)")
+    parsed = parser.parse_args()
+
+    names = parsed.levels or sorted(
+        fname[:-len(".json")] for fname in os.listdir(PUZZLES) if fname.endswith(".json")
+    )
+    report = batch_solve(
+        names, parsed.strategy, parsed.jobs, parsed.timeout, parsed.memory,
+        verbose=True, use_cache=parsed.cache,
+    )
+    with open(parsed.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    summary = report["summary"]
+    print(f"{summary['levels']} levels in {summary['wall_time']:.2f}s "
+          f"({summary['levels_per_second']:.2f} levels/s, "
+          f"{summary['expanded_per_second']:.0f} states/s)")
+    for status, count in sorted(summary["statuses"].items()):
+        print(f"  {status}: {count}")
+    print("slowest levels:")
+    for record in summary["slowest"]:
+        print(f"  {record['level']}: {record['seconds']:.2f}s ({record['status']})")
+    print(f"report written to {parsed.output}")
+    sys.exit(0 if "error" not in summary["statuses"] else 1)
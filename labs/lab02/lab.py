@@ -14,6 +14,17 @@ direction_vector = {
 }
 
 
+class Level(dict):
+    """
+    The static parts of a game (see make_level).  A Level is never modified
+    once it has been built, so every game state of a level shares the same
+    one, and copying a game (even with copy.deepcopy) does not copy it.
+    """
+
+    def __deepcopy__(self, memo):
+        return self
+
+
 def new_game(level_description):
     """
     Given a description of a game state, create and return a game
@@ -29,10 +40,118 @@ def new_game(level_description):
         [['target', 'player'], ['computer'], ['target']],
     ]
 
-    The exact choice of representation is up to you; but note that what you
-    return will be used as input to the other functions.
+    The game is represented as a dictionary with three keys:
+        'level': the static parts of the board (a Level, see make_level),
+                 shared by every game state derived from this one
+        'player': the index of the cell the player occupies
+        'computers': an int bitboard with bit i set if cell i has a computer
+
+    Game states are never modified; step_game builds a new three-key
+    dictionary, so a step costs the same however large the board is.
+    """
+    level = make_level(level_description)
+    player = None
+    computers = 0
+    for r, row in enumerate(level_description):
+        for c, cell in enumerate(row):
+            if "computer" in cell:
+                computers |= 1 << cell_index(level, r, c)
+            if "player" in cell:
+                player = cell_index(level, r, c)
+    return {"level": level, "player": player, "computers": computers}
+
+
+def make_level(level_description):
+    """
+    Build the static part of a game from a level description.
+
+    Cells are numbered in row-major order on a board padded with a border of
+    walls, so that moving off the edge of the level is just another blocked
+    move.  The returned Level has keys:
+        'dimensions': (rows, columns) of the unpadded level
+        'terrain': for each row, for each cell, a tuple of the static objects
+                   ('wall' and 'target') in that cell, used by dump_game
+        'width': number of columns of the padded board
+        'walls': int bitboard of wall cells (including the border)
+        'targets': int bitboard of target cells
+        'offsets': maps each direction to the change in cell index
+        'player_bits': number of bits needed to store a cell index
+        'dead': int bitboard of dead squares (see dead_squares)
+    """
+    num_rows = len(level_description)
+    num_cols = len(level_description[0]) if level_description else 0
+    width = num_cols + 2
+    level = Level({
+        "dimensions": (num_rows, num_cols),
+        "terrain": tuple(
+            tuple(
+                tuple(name for name in ("wall", "target") if name in cell)
+                for cell in row
+            )
+            for row in level_description
+        ),
+        "width": width,
+        "walls": 0,
+        "targets": 0,
+        "offsets": {
+            direction: dr * width + dc
+            for direction, (dr, dc) in direction_vector.items()
+        },
+    })
+    walls = 0
+    targets = 0
+    for r in range(-1, num_rows + 1):
+        for c in range(-1, num_cols + 1):
+            bit = 1 << cell_index(level, r, c)
+            if not (0 <= r < num_rows and 0 <= c < num_cols):
+                walls |= bit
+                continue
+            cell = level_description[r][c]
+            if "wall" in cell:
+                walls |= bit
+            if "target" in cell:
+                targets |= bit
+    level["walls"] = walls
+    level["targets"] = targets
+    level["player_bits"] = ((num_rows + 2) * width).bit_length()
+    level["dead"] = dead_squares(level)
+    return level
+
+
+def cell_index(level, r, c):
+    """
+    Return the index of the cell at row r and column c of the (unpadded) level.
+    """
+    return (r + 1) * level["width"] + c + 1
+
+
+def cell_location(level, index):
+    """
+    Return the (row, column) location of the cell with the given index.
     """
-    raise NotImplementedError
+    r, c = divmod(index, level["width"])
+    return r - 1, c - 1
+
+
+def bit_indices(bits):
+    """
+    Return a list of the indices of the set bits of the given int.
+    """
+    indices = []
+    while bits:
+        low = bits & -bits
+        indices.append(low.bit_length() - 1)
+        bits ^= low
+    return indices
+
+
+def is_solved(level, computers):
+    """
+    Return True if every target is covered by a computer (and there is at least
+    one target), given the bitboard of computer locations.
+    """
+    targets = level["targets"]
+    return targets != 0 and targets & computers == targets
 
 
 def victory_check(game):
@@ -41,7 +160,28 @@ def victory_check(game):
     a Boolean: True if the given game satisfies the victory condition, and
     False otherwise.
     """
-    raise NotImplementedError
+    return is_solved(game["level"], game["computers"])
+
+
+def move(level, player, computers, direction):
+    """
+    Compute the result of the player in cell player trying to move in the given
+    direction, with computers at the cells given by the computers bitboard.
+
+    Return a (player, computers) tuple describing the new positions, or None if
+    the move is blocked (by a wall, or by a computer that cannot be pushed).
+    """
+    offset = level["offsets"][direction]
+    dest = player + offset
+    dest_bit = 1 << dest
+    if level["walls"] & dest_bit:
+        return None
+    if computers & dest_bit:
+        beyond_bit = 1 << (dest + offset)
+        if (level["walls"] | computers) & beyond_bit:
+            return None
+        computers ^= dest_bit | beyond_bit
+    return dest, computers
 
 
 def step_game(game, direction):
@@ -53,7 +193,11 @@ def step_game(game, direction):
 
     This function should not mutate its input.
     """
-    raise NotImplementedError
+    result = move(game["level"], game["player"], game["computers"], direction)
+    if result is None:
+        return dict(game)
+    player, computers = result
+    return {"level": game["level"], "player": player, "computers": computers}
 
 
 def dump_game(game):
@@ -66,11 +210,633 @@ def dump_game(game):
     implementation has done, and it can also serve as a rudimentary way to
     print out the current state of your game for testing and debugging on your
     own.
+
+    The walls and targets come from the level's precomputed terrain, so only
+    the cells holding computers or the player are looked up.
+    """
+    level = game["level"]
+    board = [[list(cell) for cell in row] for row in level["terrain"]]
+    for index in bit_indices(game["computers"]):
+        r, c = cell_location(level, index)
+        board[r][c].append("computer")
+    r, c = cell_location(level, game["player"])
+    board[r][c].append("player")
+    return board
+
+
+def pull_distances(level, sources):
+    """
+    Compute the minimum number of pushes needed to move a single computer from
+    each cell onto any of the given source cells, ignoring the other computers
+    and the player's position.
+
+    This is done by "pulling" a computer backwards from the sources: a computer
+    in cell x can be pushed onto x + d if both x - d (where the player stands)
+    and x are free of walls.
+
+    Return a list giving the push distance from every cell, or None for cells
+    from which a computer can never be pushed onto a source.
+    """
+    walls = level["walls"]
+    num_cells = walls.bit_length()
+    dist = [None] * num_cells
+    for source in sources:
+        dist[source] = 0
+    agenda = list(sources)
+    for loc in agenda:
+        for offset in level["offsets"].values():
+            prev = loc - offset
+            behind = prev - offset
+            if not 0 <= behind < num_cells or dist[prev] is not None:
+                continue
+            if walls & (1 << prev | 1 << behind):
+                continue
+            dist[prev] = dist[loc] + 1
+            agenda.append(prev)
+    return dist
+
+
+def push_distances(level):
+    """
+    Return a list with one list of push distances (see pull_distances) per
+    target.
+    """
+    return [pull_distances(level, [target]) for target in bit_indices(level["targets"])]
+
+
+def dead_squares(level):
+    """
+    Return a bitboard of the open cells from which a computer can never be
+    pushed onto any target.  A computer that ends up in one of these cells
+    means the level can no longer be won.
     """
-    raise NotImplementedError
+    dist = pull_distances(level, bit_indices(level["targets"]))
+    dead = 0
+    for index, d in enumerate(dist):
+        if d is None:
+            dead |= 1 << index
+    return dead & ~level["walls"]
 
 
-def solve_puzzle(game):
+def frozen_computers(level, computers, cell, fixed, dead=None):
+    """
+    Check whether the computer in the given cell can never move again, treating
+    the cells in the fixed bitboard (walls, and computers already known to be
+    stuck) as immovable.
+
+    A computer is stuck along an axis if there is something fixed on either
+    side of it, if both sides are in the dead bitboard (by default, the dead
+    squares, which are as good as fixed when pushing a computer onto one
+    loses the level), or if a neighbouring computer on that axis is itself
+    frozen (treating this one as fixed).  It is frozen if it is stuck along
+    both axes.
+
+    Return a bitboard of the computers frozen together with this one, or 0 if
+    it can still move.
+    """
+    fixed |= 1 << cell
+    cluster = 1 << cell
+    if dead is None:
+        dead = level["dead"]
+    for offset in (1, level["width"]):
+        sides = (cell - offset, cell + offset)
+        if any(fixed >> side & 1 for side in sides):
+            continue
+        if all(dead >> side & 1 for side in sides):
+            continue
+        for side in sides:
+            if computers >> side & 1:
+                neighbours = frozen_computers(level, computers, side, fixed, dead)
+                if neighbours:
+                    cluster |= neighbours
+                    break
+        else:
+            return 0
+    return cluster
+
+
+def lost_computers(level, computers):
+    """
+    Return the number of computers that can never be pushed onto a target:
+    those on dead squares, and those off the targets that walls and other
+    computers keep from ever moving again.
+    """
+    lost = bin(computers & level["dead"]).count("1")
+    for cell in bit_indices(computers & ~level["dead"] & ~level["targets"]):
+        # only walls and computers count here, since with spare computers,
+        # pushing one onto a dead square does not lose the level
+        if frozen_computers(level, computers, cell, level["walls"], 0):
+            lost += 1
+    return lost
+
+
+def is_deadlocked(level, computers, cell, spare=0):
+    """
+    Return True if the computer that was just pushed into the given cell makes
+    the level unwinnable, given the number of computers beyond the number of
+    targets (spare).
+
+    With no spare computers, every computer has to end up on a target, so it
+    is enough that the cell is a dead square, or that the computer is frozen
+    together with at least one computer that is not on a target.  Otherwise,
+    the level is only lost once more computers are lost (see lost_computers)
+    than there are spares.
+    """
+    if spare:
+        return lost_computers(level, computers) > spare
+    if level["dead"] >> cell & 1:
+        return True
+    cluster = frozen_computers(level, computers, cell, level["walls"])
+    return cluster & ~level["targets"] != 0
+
+
+def spare_computers(game):
+    """
+    Return the number of computers in the game beyond the number of targets
+    (negative if there are too few to cover them all).
+    """
+    return bin(game["computers"]).count("1") - bin(game["level"]["targets"]).count("1")
+
+
+def min_cost_assignment(cost):
+    """
+    Given an n-by-m cost matrix (a list of n lists of m ints, with n <= m),
+    return the minimum total cost of assigning each row to a distinct column
+    (Hungarian algorithm, O(n^2 m)).
+    """
+    n = len(cost)
+    m = len(cost[0]) if cost else 0
+    big = float("inf")
+    u = [0] * (n + 1)
+    v = [0] * (m + 1)
+    match = [0] * (m + 1)
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        match[0] = i
+        j0 = 0
+        minv = [big] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = match[j0]
+            row = cost[i0 - 1]
+            delta = big
+            j1 = 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = row[j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[match[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if match[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            match[j0] = match[j1]
+            j0 = j1
+    return sum(cost[match[j] - 1][j - 1] for j in range(1, m + 1) if match[j])
+
+
+def make_heuristic(level, walking=True):
+    """
+    Build an admissible (and consistent) heuristic for the given level.
+
+    The returned function maps a player cell and a computers bitboard to a
+    lower bound on the number of moves still needed to win, or None if the
+    computers can provably never cover all of the targets.  The bound is the
+    cost of the cheapest matching of targets to distinct computers (using push
+    distances), plus, while some pushing remains, the number of steps the
+    player must walk before reaching any computer.  If walking is False, the
+    walking term is left out, giving a lower bound on the number of pushes.
+    """
+    distances = push_distances(level)
+    # any cost at least this large means some target cannot be reached
+    unreachable = len(distances) * len(distances[0]) + 1 if distances else 1
+    width = level["width"]
+    cache = {}
+
+    def matching_cost(computers):
+        if computers not in cache:
+            cells = bit_indices(computers)
+            cost = [
+                [unreachable if d[cell] is None else d[cell] for cell in cells]
+                for d in distances
+            ]
+            total = min_cost_assignment(cost)
+            cache[computers] = (
+                None if total >= unreachable else total,
+                [divmod(cell, width) for cell in cells],
+            )
+        return cache[computers]
+
+    def heuristic(player, computers):
+        pushes, locations = matching_cost(computers)
+        if not pushes or not walking:
+            return pushes
+        r, c = divmod(player, width)
+        walk = min(abs(r - cr) + abs(c - cc) for cr, cc in locations)
+        return pushes + walk - 1
+
+    return heuristic
+
+
+# number of expansions between samples of the search's frontier and visited
+# set sizes (see sample_search)
+SAMPLE_INTERVAL = 1000
+
+
+def no_trace(event, stats):
+    """
+    Default trace hook for solve_puzzle, which ignores every event.
+    """
+    pass
+
+
+def sample_search(stats, trace, frontier, visited):
+    """
+    Record the current number of states in the frontier and in the visited
+    set in stats['samples'], and report the sample to the trace hook.
+    """
+    stats["samples"].append(
+        {"expanded": stats["expanded"], "frontier": frontier, "visited": visited}
+    )
+    trace("sample", stats)
+
+
+def astar(start, successors, heuristic, is_goal, stats, trace):
+    """
+    Run an A* search over states connected by unit-cost transitions.
+
+    Parameters:
+        start: the (hashable) initial state
+        successors: function mapping a state to an iterable of (label, state)
+                    pairs, one per transition out of it
+        heuristic: function mapping a state to a consistent lower bound on its
+                   distance to a goal, or None if no goal can be reached
+        is_goal: function mapping a state to a Boolean
+        stats: dictionary of counters to update (see solve_puzzle)
+        trace: hook to call with each event (see solve_puzzle)
+
+    Returns:
+        the list of labels along a shortest path to a goal, or None if there
+        is no such path
+
+    Since every transition costs 1, the frontier is a bucket queue indexed by
+    f = g + h; within a bucket the most recently added (deepest) state is
+    expanded first.  With a consistent heuristic, the first time a state is
+    expanded its cost is optimal.
+    """
+    trace("search", stats)
+    h = heuristic(start)
+    if h is None:
+        return None
+    best_cost = {start: 0}
+    parent = {start: None}
+    buckets = [[] for _ in range(h + 1)]
+    buckets[h].append((0, start))
+    frontier = 1
+    f = h
+    while f < len(buckets):
+        bucket = buckets[f]
+        if not bucket:
+            f += 1
+            continue
+        if frontier > stats["peak_frontier"]:
+            stats["peak_frontier"] = frontier
+        g, state = bucket.pop()
+        frontier -= 1
+        if g > best_cost[state]:
+            continue
+        stats["expanded"] += 1
+        if stats["expanded"] % SAMPLE_INTERVAL == 0:
+            sample_search(stats, trace, frontier, len(best_cost))
+        if is_goal(state):
+            trace("reconstruct", stats)
+            path = []
+            while parent[state] is not None:
+                state, label = parent[state]
+                path.append(label)
+            return path[::-1]
+        for label, new_state in successors(state):
+            if new_state in best_cost and best_cost[new_state] <= g + 1:
+                stats["duplicates"] += 1
+                continue
+            h = heuristic(new_state)
+            if h is None:
+                stats["pruned"] += 1
+                continue
+            best_cost[new_state] = g + 1
+            parent[new_state] = (state, label)
+            while len(buckets) <= g + 1 + h:
+                buckets.append([])
+            buckets[g + 1 + h].append((g + 1, new_state))
+            frontier += 1
+    return None
+
+
+def move_space(game, stats):
+    """
+    Describe the search space of single player moves from the given game, as
+    a (start, successors, heuristic, is_goal) tuple suitable for astar or ida.
+
+    Each state is packed into a single int, with the computers bitboard in the
+    high bits and the player's cell index in the low level['player_bits'] bits,
+    so that hashing and comparing states are integer operations.  Successors in
+    which the pushed computer is deadlocked (see is_deadlocked) are pruned.
+    """
+    level = game["level"]
+    spare = spare_computers(game)
+    player_bits = level["player_bits"]
+    player_mask = (1 << player_bits) - 1
+    move_heuristic = make_heuristic(level)
+
+    def successors(state):
+        player = state & player_mask
+        computers = state >> player_bits
+        out = []
+        for direction in direction_vector:
+            result = move(level, player, computers, direction)
+            if result is None:
+                continue
+            stats["generated"] += 1
+            new_player, new_computers = result
+            if new_computers != computers:
+                pushed = 2 * new_player - player
+                if is_deadlocked(level, new_computers, pushed, spare):
+                    stats["pruned"] += 1
+                    continue
+            out.append((direction, new_computers << player_bits | new_player))
+        return out
+
+    def heuristic(state):
+        return move_heuristic(state & player_mask, state >> player_bits)
+
+    def is_goal(state):
+        return is_solved(level, state >> player_bits)
+
+    start = game["computers"] << player_bits | game["player"]
+    return start, successors, heuristic, is_goal
+
+
+def search_moves(game, stats, trace):
+    """
+    Find a shortest solution with A* over single player moves.  Fast, but the
+    search tables grow with the number of states reached.
+    """
+    return astar(*move_space(game, stats), stats, trace)
+
+
+def ida(start, successors, heuristic, is_goal, stats, trace, table_size):
+    """
+    Run an iterative-deepening A* search (same parameters and result as
+    astar), using memory proportional to the depth of the search plus a
+    transposition table of fixed size.
+
+    Each iteration is a depth-first search that cuts off states whose
+    f = g + h exceeds a threshold, starting from the heuristic value of the
+    start state and raised to the smallest f that was cut off.  The table has
+    table_size slots, indexed by the hash of the state; a state is skipped if
+    its slot shows it was already reached in this iteration at no greater
+    cost.  A slot is overwritten if it is empty, left over from an earlier
+    iteration, or holds a state reached at a greater or equal cost (entries
+    near the root cut off larger subtrees, so they are kept).
+
+    A state cut off by the threshold only sets the next threshold if it was
+    not also reached within the threshold, at no greater cost, in the same
+    iteration: anything past it is then already covered by the cheaper
+    visit.  Once no cut-off is left, every state reachable from the start
+    has been searched, and the level is unsolvable.  This is only detected if
+    the table can hold the states searched in one iteration (and the cut-offs
+    waiting to be checked against it), which is the case for levels small
+    enough to search exhaustively; on larger unsolvable levels, IDA* keeps
+    raising the threshold until every path has been tried, so the other
+    strategies are much better at proving that a level has no solution.
+
+    The number of iterations run is stored in stats['iterations'], and the
+    samples' visited set size is the number of table slots in use.
+    """
+    trace("search", stats)
+    threshold = heuristic(start)
+    if threshold is None:
+        return None
+    keys = [None] * table_size
+    costs = [0] * table_size
+    iterations = [0] * table_size
+    filled = 0
+    iteration = 0
+    stats["expanded"] += 1
+    if is_goal(start):
+        trace("reconstruct", stats)
+        return []
+    while True:
+        iteration += 1
+        stats["iterations"] = iteration
+        exceeded = None
+        # states cut off by the threshold, mapped to the (cost, f) of their
+        # cheapest cut-off, up to table_size of them (see above)
+        cut_off = {}
+        labels = []
+        on_path = {start}
+        stack = [(start, 0, iter(successors(start)))]
+        while stack:
+            state, g, children = stack[-1]
+            for label, child in children:
+                if child in on_path:
+                    stats["duplicates"] += 1
+                    continue
+                # checked before the threshold, so that a child already
+                # reached more cheaply does not raise the next threshold
+                slot = hash(child) % table_size
+                known = iterations[slot] == iteration and keys[slot] == child
+                if known and costs[slot] <= g + 1:
+                    stats["duplicates"] += 1
+                    continue
+                h = heuristic(child)
+                if h is None:
+                    stats["pruned"] += 1
+                    continue
+                if g + 1 + h > threshold:
+                    if child in cut_off:
+                        if g + 1 < cut_off[child][0]:
+                            cut_off[child] = (g + 1, g + 1 + h)
+                    elif len(cut_off) < table_size:
+                        cut_off[child] = (g + 1, g + 1 + h)
+                    elif exceeded is None or g + 1 + h < exceeded:
+                        exceeded = g + 1 + h
+                    continue
+                if known:
+                    costs[slot] = g + 1
+                elif iterations[slot] != iteration or g + 1 <= costs[slot]:
+                    if keys[slot] is None:
+                        filled += 1
+                    keys[slot] = child
+                    costs[slot] = g + 1
+                    iterations[slot] = iteration
+                stats["expanded"] += 1
+                if stats["expanded"] % SAMPLE_INTERVAL == 0:
+                    sample_search(stats, trace, len(stack), filled)
+                labels.append(label)
+                if is_goal(child):
+                    trace("reconstruct", stats)
+                    return labels
+                on_path.add(child)
+                stack.append((child, g + 1, iter(successors(child))))
+                if len(stack) > stats["peak_frontier"]:
+                    stats["peak_frontier"] = len(stack)
+                break
+            else:
+                stack.pop()
+                on_path.discard(state)
+                if g:
+                    labels.pop()
+        for child, (cost, f) in cut_off.items():
+            slot = hash(child) % table_size
+            if iterations[slot] == iteration and keys[slot] == child and costs[slot] <= cost:
+                continue
+            if exceeded is None or f < exceeded:
+                exceeded = f
+        if exceeded is None:
+            return None
+        threshold = exceeded
+
+
+# number of slots in the transposition table used by search_ida (a prime, so
+# that the slot of a packed state depends on all of its bits)
+TRANSPOSITION_TABLE_SIZE = 65521
+
+
+def search_ida(game, stats, trace):
+    """
+    Find a shortest solution with IDA* over single player moves.  Slower than
+    search_moves, since states are revisited on every iteration, but memory
+    only grows with the length of the solution.
+    """
+    return ida(*move_space(game, stats), stats, trace, TRANSPOSITION_TABLE_SIZE)
+
+
+def reachable_cells(level, player, computers):
+    """
+    Return a bitboard of the cells the player can walk to from the given cell
+    without pushing anything (flood fill, one ring of cells per iteration).
+    """
+    width = level["width"]
+    free = ~(level["walls"] | computers)
+    reach = 1 << player
+    while True:
+        grown = (reach | reach << 1 | reach >> 1 | reach << width | reach >> width) & free
+        if grown == reach:
+            return reach
+        reach = grown
+
+
+def walk_path(level, computers, start, goal):
+    """
+    Return a list of directions leading the player from cell start to cell
+    goal without pushing any computer (breadth-first search), or None if the
+    goal cannot be reached.
+    """
+    blocked = level["walls"] | computers
+    parent = {start: None}
+    agenda = [start]
+    for cell in agenda:
+        if cell == goal:
+            path = []
+            while parent[cell] is not None:
+                cell, direction = parent[cell]
+                path.append(direction)
+            return path[::-1]
+        for direction, offset in level["offsets"].items():
+            neighbor = cell + offset
+            if neighbor not in parent and not blocked >> neighbor & 1:
+                parent[neighbor] = (cell, direction)
+                agenda.append(neighbor)
+    return None
+
+
+def search_pushes(game, stats, trace):
+    """
+    Find a solution using the fewest pushes, by searching over pushes instead
+    of single player moves.
+
+    A state is the computers bitboard together with the canonical (lowest
+    numbered) cell of the region the player can walk to, packed into an int as
+    in search_moves, so states that differ only in where the player stands
+    within one region are the same state.  Every transition is one push, made
+    from any cell of that region; the walks between pushes are filled in with
+    walk_path once a solution is found, so the result is optimal in pushes but
+    not necessarily in moves.
+    """
+    level = game["level"]
+    spare = spare_computers(game)
+    offsets = level["offsets"]
+    player_bits = level["player_bits"]
+    player_mask = (1 << player_bits) - 1
+    push_heuristic = make_heuristic(level, walking=False)
+
+    def normalize(player, computers):
+        reach = reachable_cells(level, player, computers)
+        canonical = (reach & -reach).bit_length() - 1
+        return computers << player_bits | canonical, reach
+
+    def successors(state):
+        computers = state >> player_bits
+        _, reach = normalize(state & player_mask, computers)
+        blocked = level["walls"] | computers
+        out = []
+        for cell in bit_indices(computers):
+            for direction, offset in offsets.items():
+                if not reach >> (cell - offset) & 1 or blocked >> (cell + offset) & 1:
+                    continue
+                stats["generated"] += 1
+                new_computers = computers ^ (1 << cell | 1 << (cell + offset))
+                if is_deadlocked(level, new_computers, cell + offset, spare):
+                    stats["pruned"] += 1
+                    continue
+                new_state, _ = normalize(cell, new_computers)
+                out.append(((cell, direction), new_state))
+        return out
+
+    def heuristic(state):
+        return push_heuristic(state & player_mask, state >> player_bits)
+
+    def is_goal(state):
+        return is_solved(level, state >> player_bits)
+
+    start, _ = normalize(game["player"], game["computers"])
+    pushes = astar(start, successors, heuristic, is_goal, stats, trace)
+    if pushes is None:
+        return None
+
+    path = []
+    player = game["player"]
+    computers = game["computers"]
+    for cell, direction in pushes:
+        offset = offsets[direction]
+        path.extend(walk_path(level, computers, player, cell - offset))
+        path.append(direction)
+        computers ^= 1 << cell | 1 << (cell + offset)
+        player = cell
+    return path
+
+
+solvers = {
+    "moves": search_moves,
+    "ida": search_ida,
+    "pushes": search_pushes,
+}
+
+
+def solve_puzzle(game, stats=None, strategy="moves", trace=no_trace):
     """
     Given a game representation (of the form returned from new game), find a
     solution.
@@ -79,8 +845,53 @@ def solve_puzzle(game):
     "down", "left", and "right") needed to reach the victory condition.
 
     If the given level cannot be solved, return None.
+
+    The strategy argument selects the search:
+        'moves': A* over single moves (see search_moves); the solution is a
+                 shortest one
+        'ida': IDA* over single moves (see search_ida); also finds a shortest
+               solution, trading extra time for much less memory than 'moves'
+        'pushes': A* over pushes (see search_pushes); much faster on large
+                  levels, but the solution is only guaranteed to use the
+                  fewest pushes, not the fewest moves
+
+    All of them use the heuristic from make_heuristic and prune deadlocked
+    states.  If stats is a dictionary, the following are stored in it:
+        'expanded': number of states expanded
+        'generated': number of successor states produced by legal moves
+        'duplicates': number of successors dropped because they had already
+                      been reached at no greater cost
+        'pruned': number of successors dropped as deadlocked or unwinnable
+        'peak_frontier': largest number of states waiting in the frontier (for
+                         IDA*, the deepest the search stack got)
+        'samples': list of dictionaries with the number of states 'expanded'
+                   so far, and the 'frontier' and 'visited' set sizes at that
+                   point, taken every SAMPLE_INTERVAL expansions
+
+    trace is called as trace(event, stats) as the solver goes through its
+    phases: 'setup' (precomputing heuristics), 'search', 'reconstruct'
+    (building the move list once a goal is found) and 'done', plus a 'sample'
+    event whenever a sample is added.  Timing each phase is left to the hook.
     """
-    raise NotImplementedError
+    if strategy not in solvers:
+        raise ValueError(f"unknown strategy {strategy!r}")
+    if stats is None:
+        stats = {}
+    for counter in ("expanded", "generated", "duplicates", "pruned", "peak_frontier"):
+        stats[counter] = 0
+    stats["samples"] = []
+    trace("setup", stats)
+    spare = spare_computers(game)
+    solution = None
+    # a level with no targets can never be won (see is_solved)
+    if (
+        game["level"]["targets"]
+        and spare >= 0
+        and lost_computers(game["level"], game["computers"]) <= spare
+    ):
+        solution = solvers[strategy](game, stats, trace)
+    trace("done", stats)
+    return solution
 
 
 if __name__ == "__main__":
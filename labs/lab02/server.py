@@ -1,17 +1,36 @@
 import os
 import html
 import json
+import time
+import secrets
 import importlib
 import mimetypes
+import threading
 import traceback
+import socketserver
+import http.cookies
 
 from wsgiref.handlers import read_environ
-from wsgiref.simple_server import make_server
+from wsgiref.simple_server import make_server, WSGIServer
 
 import lab as lab
+import solver_stats
+import solution_cache
 
 LOCATION = os.path.realpath(os.path.dirname(__file__))
-CURRENT_GAME = None
+
+# game states, keyed by session id.  each session maps to a dictionary with
+# keys 'game', 'last_used' (a time.monotonic() timestamp) and 'lock' (held
+# while the session's game is being updated)
+SESSIONS = {}
+SESSIONS_LOCK = threading.Lock()
+SESSION_COOKIE = "snekoban_session"
+SESSION_IDLE_SECONDS = 30 * 60
+
+# parsed level files, keyed by filename, as (modification time, level) tuples,
+# and the cached get_levels listing as a (modification time, levels) tuple
+LEVEL_CACHE = {}
+LEVEL_LIST_CACHE = None
 
 # Code for parsing ASCII level files
 character_map = {
@@ -34,56 +53,142 @@ def parse_post(environ):
         return {}
 
 
-def new_game(params):
-    global CURRENT_GAME
+def load_level(params):
+    if 'raw' in params:
+        return json.loads(params['raw'])
+    filename = os.path.join(LOCATION, 'puzzles', params["level"])
+    mtime = os.stat(filename).st_mtime
+    cached = LEVEL_CACHE.get(filename)
+    if cached is not None and cached[0] == mtime:
+        # shared between sessions; lab.new_game must not mutate its input
+        return cached[1]
+    with open(filename) as f:
+        level = json.load(f)
+        if isinstance(level, dict) and "input" in level:
+            level = level["input"]
+    LEVEL_CACHE[filename] = (mtime, level)
+    return level
+
+
+def get_session(session_id):
+    """
+    Return the session with the given id, creating it if needed, and evict
+    every other session that has been idle for too long.
+    """
+    now = time.monotonic()
+    with SESSIONS_LOCK:
+        for other_id, other in list(SESSIONS.items()):
+            if now - other["last_used"] > SESSION_IDLE_SECONDS and other_id != session_id:
+                del SESSIONS[other_id]
+        session = SESSIONS.setdefault(
+            session_id, {"game": None, "last_used": now, "lock": threading.Lock()}
+        )
+        session["last_used"] = now
+    return session
+
+
+def reload_lab(params):
     print("[reloading lab.py in case you changed something]")
     importlib.reload(lab)
-    if 'raw' in params:
-        level = json.loads(params['raw'])
-    else:
-        level = params["level"]
-        with open(os.path.join(LOCATION, 'puzzles', level)) as f:
-            level = json.load(f)
-            if isinstance(level, dict) and "input" in level:
-                level = level["input"]
-    CURRENT_GAME = lab.new_game(level)
+    return True
+
+
+def game_response(game):
     return {
-        "board": lab.dump_game(CURRENT_GAME),
-        "victory": lab.victory_check(CURRENT_GAME),
+        "board": lab.dump_game(game),
+        "victory": lab.victory_check(game),
     }
 
 
+def new_game(params):
+    if params.get("reload"):
+        reload_lab(params)
+    session = get_session(params["session"])
+    game = lab.new_game(load_level(params))
+    with session["lock"]:
+        session["game"] = game
+    return game_response(game)
+
+
 def step_game(params):
-    global CURRENT_GAME
+    session = get_session(params["session"])
     direction = params["direction"]
-    CURRENT_GAME = lab.step_game(CURRENT_GAME, direction)
-    return {
-        "board": lab.dump_game(CURRENT_GAME),
-        "victory": lab.victory_check(CURRENT_GAME),
-    }
+    with session["lock"]:
+        if session["game"] is None:
+            raise ValueError("no game in progress for this session; start a new game first")
+        session["game"] = game = lab.step_game(session["game"], direction)
+    return game_response(game)
 
 
-def get_levels(params):
-    return sorted(
-        fname
-        for fname in os.listdir(os.path.join(LOCATION, "puzzles"))
-        if fname.endswith(".json")
+def solve_puzzle(params):
+    stats = {}
+    solution = solution_cache.cached_solve(
+        load_level(params), params.get("strategy", "moves"), stats
+    )
+    return {"solution": solution, "cached": stats["cached"]}
+
+
+def solve_stats(params):
+    solution, stats = solver_stats.instrumented_solve(
+        lab.new_game(load_level(params)), params.get("strategy", "moves")
     )
+    stats["length"] = None if solution is None else len(solution)
+    return stats
+
+
+def get_levels(params):
+    global LEVEL_LIST_CACHE
+    directory = os.path.join(LOCATION, "puzzles")
+    mtime = os.stat(directory).st_mtime
+    if LEVEL_LIST_CACHE is None or LEVEL_LIST_CACHE[0] != mtime:
+        LEVEL_LIST_CACHE = (mtime, sorted(
+            fname
+            for fname in os.listdir(directory)
+            if fname.endswith(".json")
+        ))
+    return LEVEL_LIST_CACHE[1]
 
 
 funcs = {
     "new_game": new_game,
     "step_game": step_game,
+    "reload": reload_lab,
+    "solve_puzzle": solve_puzzle,
+    "solve_stats": solve_stats,
     "get_levels": get_levels,
     "all_objects": lambda params: character_map,
 }
 
 
+def session_id(environ, params):
+    """
+    Find the session id for a request: an explicit 'session' parameter, or the
+    session cookie.  Returns a (session id, is new) tuple, making up a new id
+    if the request has neither.
+    """
+    if "session" in params:
+        return str(params["session"]), False
+    cookies = http.cookies.SimpleCookie(environ.get("HTTP_COOKIE", ""))
+    if SESSION_COOKIE in cookies:
+        return cookies[SESSION_COOKIE].value, False
+    return secrets.token_hex(16), True
+
+
 def application(environ, start_response):
     path = (environ.get("PATH_INFO", "") or "").lstrip("/")
+    extra_headers = []
     if path in funcs:
         try:
-            out = funcs[path](parse_post(environ))
+            params = parse_post(environ)
+            if not isinstance(params, dict):
+                params = {}
+            params["session"], new_session = session_id(environ, params)
+            if new_session:
+                extra_headers.append((
+                    "Set-Cookie",
+                    f"{SESSION_COOKIE}={params['session']}; Path=/; HttpOnly; SameSite=Strict",
+                ))
+            out = funcs[path](params)
             body = json.dumps(out).encode("utf-8")
             status = "200 OK"
             type_ = "application/json"
@@ -124,14 +229,22 @@ def application(environ, start_response):
             type_ = "text/plain"
 
     len_ = str(len(body))
-    headers = [("Content-type", type_), ("Content-length", len_)]
+    headers = [("Content-type", type_), ("Content-length", len_), *extra_headers]
     start_response(status, headers)
     return [body]
 
 
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    """
+    WSGI server handling each request in its own thread, so that one slow
+    request (e.g. solving a large level) does not hold up other players.
+    """
+    daemon_threads = True
+
+
 if __name__ == "__main__":
     print("starting server.  navigate to http://localhost:6009/")
-    with make_server("", 6009, application) as httpd:
+    with make_server("", 6009, application, server_class=ThreadingWSGIServer) as httpd:
         try:
             httpd.serve_forever()
         except KeyboardInterrupt:
@@ -0,0 +1,128 @@
+"""
+On-disk store of Snekoban solutions, keyed by a canonical hash of the level.
+
+Example usage:
+    solution = cached_solve(level_description)
+
+The same layout gets the same key whether it was loaded from a file in
+puzzles/ or given as raw JSON, since the key only depends on which objects are
+in which cell.  Each level is stored as one JSON file in the cache directory,
+holding the solution found by each solver strategy (or null for levels that
+cannot be solved).
+
+Stored solutions are checked by replaying them before they are used, but a
+null cannot be checked that way, so it is only trusted if it was stored by the
+current SOLVER_VERSION.
+"""
+import os
+import json
+import hashlib
+
+import lab
+
+LOCATION = os.path.realpath(os.path.dirname(__file__))
+CACHE_DIRECTORY = os.path.join(LOCATION, "solution_cache")
+
+# bump this whenever a change to lab.solve_puzzle could change which levels it
+# reports as unsolvable, so that stored nulls from older solvers are ignored
+SOLVER_VERSION = 2
+
+
+def level_hash(level_description):
+    """
+    Return a hex digest identifying the given level description, which does
+    not depend on the order of the objects within a cell or on formatting.
+    """
+    canonical = [[sorted(cell) for cell in row] for row in level_description]
+    text = json.dumps(canonical, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _entry_filename(key, cache_directory):
+    return os.path.join(cache_directory, f"{key}.json")
+
+
+def _read_entry(key, cache_directory):
+    """
+    Read the stored entry for the given key, leaving out any nulls stored by
+    another solver version.
+    """
+    try:
+        with open(_entry_filename(key, cache_directory)) as f:
+            entry = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    if entry.get("solver_version") != SOLVER_VERSION:
+        entry = {strategy: solution for strategy, solution in entry.items() if solution is not None}
+    entry.pop("solver_version", None)
+    return entry
+
+
+def is_valid_solution(level_description, solution):
+    """
+    Check a solution by replaying it with step_game: it must win the level on
+    its last move, and not before (an empty solution is only valid for a level
+    that is already won).
+    """
+    game = lab.new_game(level_description)
+    for direction in solution:
+        if direction not in lab.direction_vector or lab.victory_check(game):
+            return False
+        game = lab.step_game(game, direction)
+    return lab.victory_check(game)
+
+
+def load_solution(level_description, strategy="moves", cache_directory=CACHE_DIRECTORY):
+    """
+    Look up the solution stored for the given level and strategy.
+
+    Returns a (found, solution) tuple: found is False if nothing usable is
+    stored (including stored solutions that no longer win the level, and
+    nulls stored by another SOLVER_VERSION), and solution is the list of
+    moves, or None for a level known to be unsolvable.
+    """
+    entry = _read_entry(level_hash(level_description), cache_directory)
+    if strategy not in entry:
+        return False, None
+    solution = entry[strategy]
+    if solution is not None and not is_valid_solution(level_description, solution):
+        return False, None
+    return True, solution
+
+
+def store_solution(level_description, solution, strategy="moves", cache_directory=CACHE_DIRECTORY):
+    """
+    Store the solution (a list of moves, or None if the level cannot be solved)
+    for the given level and strategy.
+
+    The entry is written to a temporary file and then renamed over the old
+    one, so concurrent readers never see a partially written entry.
+    """
+    os.makedirs(cache_directory, exist_ok=True)
+    key = level_hash(level_description)
+    entry = _read_entry(key, cache_directory)
+    entry[strategy] = solution
+    entry["solver_version"] = SOLVER_VERSION
+    filename = _entry_filename(key, cache_directory)
+    temp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(temp_filename, "w") as f:
+        json.dump(entry, f)
+    os.replace(temp_filename, filename)
+
+
+def cached_solve(level_description, strategy="moves", stats=None, cache_directory=CACHE_DIRECTORY):
+    """
+    Return the solution to the given level (as from lab.solve_puzzle), using
+    the stored solution if there is a valid one, and solving and storing it
+    otherwise.  If stats is a dictionary, its 'cached' key is set to whether
+    the stored solution was used.
+    """
+    if stats is None:
+        stats = {}
+    found, solution = load_solution(level_description, strategy, cache_directory)
+    stats["cached"] = found
+    if found:
+        return solution
+    solution = lab.solve_puzzle(lab.new_game(level_description), stats, strategy)
+    store_solution(level_description, solution, strategy, cache_directory)
+    return solution
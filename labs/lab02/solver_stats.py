@@ -0,0 +1,57 @@
+"""
+Timing and statistics for solve_puzzle runs.
+
+Example usage:
+    solution, stats = instrumented_solve(lab.new_game(level_description))
+    print(stats["expanded"], stats["timings"]["search"])
+
+lab.solve_puzzle counts what the search does (see its docstring) and calls a
+trace hook at each phase, but it cannot read the clock itself.  SolverTrace is
+such a hook: it records when each phase starts and when each sample is taken.
+"""
+import time
+
+import lab
+
+
+class SolverTrace:
+    """
+    Trace hook for lab.solve_puzzle that records the time of every event.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = []
+
+    def __call__(self, event, stats):
+        now = time.perf_counter() - self.start
+        if event == "sample":
+            stats["samples"][-1]["seconds"] = now
+        else:
+            self.phases.append((event, now))
+
+    def timings(self):
+        """
+        Return a dictionary mapping each phase that was entered to the number
+        of seconds spent in it.
+        """
+        return {
+            event: end - start
+            for (event, start), (_, end) in zip(self.phases, self.phases[1:])
+        }
+
+
+def instrumented_solve(game, strategy="moves"):
+    """
+    Solve the given game with lab.solve_puzzle, and return a (solution, stats)
+    tuple.  stats holds the counters and samples from solve_puzzle, plus
+    'timings' (seconds spent in each phase), 'seconds' (total time) and
+    'strategy'.
+    """
+    trace = SolverTrace()
+    stats = {}
+    solution = lab.solve_puzzle(game, stats, strategy, trace)
+    stats["timings"] = trace.timings()
+    stats["seconds"] = time.perf_counter() - trace.start
+    stats["strategy"] = strategy
+    return solution, stats
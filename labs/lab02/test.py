@@ -6,6 +6,7 @@ import json
 import pickle
 
 import lab
+import solution_cache
 
 sys.setrecursionlimit(10000)
 
@@ -130,6 +131,232 @@ def test_solver(test_group):
             compare_solution(puzzle, result)
 
 
+def test_solver_prunes_deadlocks():
+    with open(os.path.join(TEST_DIRECTORY, "puzzles", "m2_089.json")) as f:
+        level = json.load(f)
+    game = lab.new_game(level)
+    stats = {}
+    result = lab.solve_puzzle(game, stats)
+    assert len(result) == 67
+    compare_solution("m2_089", result)
+    assert stats["pruned"] > 0
+    assert stats["expanded"] > 0
+
+
+def test_solver_spare_computers():
+    # with more computers than targets, a computer on a dead square or frozen
+    # off the targets is only fatal once there are no spares left
+    level = [[["computer"], [], [], []], [[], ["player"], ["computer"], ["target"]]]
+    for strategy in lab.solvers:
+        assert lab.solve_puzzle(lab.new_game(level), strategy=strategy) == ["right"]
+    level = [[["computer"], [], ["computer"]], [[], ["player"], ["target"]]]
+    for strategy in lab.solvers:
+        assert lab.solve_puzzle(lab.new_game(level), strategy=strategy) is None
+
+
+def test_solver_no_targets():
+    # a level without targets cannot be won, so it has no solution
+    level = [[["player"], [], ["computer"], []]]
+    assert not lab.victory_check(lab.new_game(level))
+    start, _, _, is_goal = lab.move_space(lab.new_game(level), {})
+    assert not is_goal(start)
+    for strategy in lab.solvers:
+        assert lab.solve_puzzle(lab.new_game(level), strategy=strategy) is None
+
+
+def test_solver_ida_unsolvable():
+    # neither computer starts on a dead square or in a deadlock, so only
+    # running out of states proves that this level cannot be won
+    level = [
+        [["target"], [], [], [], [], []],
+        [[], [], [], [], [], []],
+        [["computer"], ["player"], [], [], ["computer"], []],
+        [[], ["wall"], [], [], [], []],
+        [[], ["wall"], [], ["wall"], ["target"], []],
+    ]
+    stats = {}
+    assert lab.solve_puzzle(lab.new_game(level), stats, strategy="ida") is None
+    assert stats["iterations"] < 40
+    assert lab.solve_puzzle(lab.new_game(level), strategy="moves") is None
+
+
+@pytest.mark.parametrize('test_group', ['small', 'medium', 'large'])
+def test_solver_pushes(test_group):
+    # push-level search only promises the fewest pushes, so just check that
+    # solutions exist when they should and actually win the level
+    for puzzle, elen in zip(SOLVER_TEST_GROUPS[test_group], SOLUTION_LENGTHS[test_group]):
+        with open(os.path.join(TEST_DIRECTORY, "puzzles", f"{puzzle}.json")) as f:
+            level = json.load(f)
+        result = lab.solve_puzzle(lab.new_game(level), strategy="pushes")
+        if elen is None:
+            assert result is None, f"Expected no solution for {puzzle}, but got one."
+        else:
+            assert result is not None, f"Expected a solution for {puzzle}, got None."
+            assert len(result) >= elen
+            compare_solution(puzzle, result)
+
+
+def test_solver_ida():
+    for puzzle, elen in zip(SOLVER_TEST_GROUPS['small'], SOLUTION_LENGTHS['small']):
+        with open(os.path.join(TEST_DIRECTORY, "puzzles", f"{puzzle}.json")) as f:
+            level = json.load(f)
+        result = lab.solve_puzzle(lab.new_game(level), strategy="ida")
+        if elen is None:
+            assert result is None, f"Expected no solution for {puzzle}, but got one."
+        else:
+            assert result is not None, f"Expected a solution for {puzzle}, got None."
+            assert len(result) == elen, f"Expected a solution of length {elen} for {puzzle}, got {len(result)}."
+            compare_solution(puzzle, result)
+
+
+def test_solution_cache(tmp_path, monkeypatch):
+    with open(os.path.join(TEST_DIRECTORY, "puzzles", "m1_001.json")) as f:
+        level = json.load(f)
+    # the same layout, with the objects in each cell listed in another order
+    shuffled = [[cell[::-1] for cell in row] for row in level]
+    assert solution_cache.level_hash(level) == solution_cache.level_hash(shuffled)
+
+    stats = {}
+    result = solution_cache.cached_solve(level, stats=stats, cache_directory=tmp_path)
+    assert not stats["cached"] and len(result) == 33
+    assert solution_cache.cached_solve(shuffled, stats=stats, cache_directory=tmp_path) == result
+    assert stats["cached"]
+
+    # a solution must win on its last move, not before
+    assert solution_cache.is_valid_solution(level, result)
+    assert not solution_cache.is_valid_solution(level, result + ["up", "down"])
+
+    # a stored solution that no longer wins the level is ignored
+    solution_cache.store_solution(level, result[:-1], cache_directory=tmp_path)
+    assert solution_cache.load_solution(level, cache_directory=tmp_path) == (False, None)
+    assert solution_cache.cached_solve(level, stats=stats, cache_directory=tmp_path) == result
+    assert not stats["cached"]
+
+    # a null stored by another solver version is ignored
+    solution_cache.store_solution(level, None, cache_directory=tmp_path)
+    assert solution_cache.load_solution(level, cache_directory=tmp_path) == (True, None)
+    monkeypatch.setattr(solution_cache, "SOLVER_VERSION", solution_cache.SOLVER_VERSION + 1)
+    assert solution_cache.load_solution(level, cache_directory=tmp_path) == (False, None)
+    assert solution_cache.cached_solve(level, stats=stats, cache_directory=tmp_path) == result
+
+
+def test_solver_trace():
+    with open(os.path.join(TEST_DIRECTORY, "puzzles", "m2_089.json")) as f:
+        level = json.load(f)
+    events = []
+    stats = {}
+    result = lab.solve_puzzle(lab.new_game(level), stats, trace=lambda event, s: events.append(event))
+    assert len(result) == 67
+    phases = [event for event in events if event != "sample"]
+    assert phases == ["setup", "search", "reconstruct", "done"]
+    assert events.count("sample") == len(stats["samples"]) == stats["expanded"] // lab.SAMPLE_INTERVAL
+    assert stats["generated"] >= stats["duplicates"] + stats["pruned"]
+
+
+
+def test_batch_solve():
+    import batch
+    report = batch.batch_solve(["m1_044", "t_001", "m1_001"], jobs=2, timeout=30)
+    assert (report["strategy"], report["timeout"], report["memory"]) == ("moves", 30, None)
+    records = report["results"]
+    assert [record["level"] for record in records] == ["m1_001", "m1_044", "t_001"]
+    assert [record["status"] for record in records] == ["solved", "solved", "unsolvable"]
+    assert [record["length"] for record in records] == [33, 1, None]
+    for record in records[:2]:
+        assert record["seconds"] >= 0
+        assert record["expanded"] > 0 and record["peak_frontier"] > 0
+    summary = report["summary"]
+    assert summary["levels"] == 3
+    assert summary["statuses"] == {"solved": 2, "unsolvable": 1}
+    assert summary["levels_per_second"] > 0
+    assert [record["seconds"] for record in summary["slowest"]] == sorted(
+        (record["seconds"] for record in records), reverse=True
+    )
+
+    # IDA* takes several seconds on this level, well past its time limit
+    report = batch.batch_solve(["m1_154"], strategy="ida", jobs=1, timeout=1)
+    (record,) = report["results"]
+    assert record["status"] == "timeout" and "length" not in record
+    assert 1 <= record["seconds"] < 5
+    assert report["summary"]["statuses"] == {"timeout": 1}
+
+def server_request(server, path, params, cookie=None):
+    """
+    Send a request to the server's WSGI application, with params as its JSON
+    body and the given session cookie, and return its status, decoded JSON
+    body (None on an error) and the session cookie it sets (if any).
+    """
+    import io
+    body = json.dumps(params).encode("utf-8")
+    environ = {"PATH_INFO": path, "CONTENT_LENGTH": str(len(body)), "wsgi.input": io.BytesIO(body)}
+    if cookie is not None:
+        environ["HTTP_COOKIE"] = f"{server.SESSION_COOKIE}={cookie}"
+    response = {}
+    def start_response(status, headers):
+        response["status"] = status
+        response["headers"] = dict(headers)
+    result = b"".join(server.application(environ, start_response))
+    set_cookie = response["headers"].get("Set-Cookie")
+    if set_cookie is not None:
+        set_cookie = set_cookie.split(";")[0].split("=", 1)[1]
+    ok = response["status"] == "200 OK"
+    return response["status"], json.loads(result) if ok else None, set_cookie
+
+
+def test_server_sessions(monkeypatch, capsys):
+    # each cookie should get its own game, and games idle for too long should
+    # be dropped without touching the others
+    import server
+    monkeypatch.setattr(server, "SESSIONS", {})
+    raw = json.dumps([[["wall"], [], ["player"], [], ["wall"]]])
+    status, first, alice = server_request(server, "/new_game", {"raw": raw})
+    assert status == "200 OK" and alice is not None
+    status, _, bob = server_request(server, "/new_game", {"raw": raw})
+    assert bob is not None and bob != alice
+    assert server_request(server, "/new_game", {"raw": raw}, alice)[2] is None
+
+    _, left, _ = server_request(server, "/step_game", {"direction": "left"}, alice)
+    _, right, _ = server_request(server, "/step_game", {"direction": "right"}, bob)
+    assert left["board"] != right["board"] != first["board"]
+    _, again, _ = server_request(server, "/step_game", {"direction": "left"}, alice)
+    assert again["board"] == left["board"]
+    assert set(server.SESSIONS) == {alice, bob}
+
+    server.SESSIONS[alice]["last_used"] -= server.SESSION_IDLE_SECONDS + 1
+    _, still, _ = server_request(server, "/step_game", {"direction": "left"}, bob)
+    assert still["board"] == first["board"]
+    assert set(server.SESSIONS) == {bob}
+    # the evicted session has to start a new game
+    status, _, _ = server_request(server, "/step_game", {"direction": "left"}, alice)
+    assert status.startswith("500")
+    assert "no game in progress" in capsys.readouterr().out
+
+
+def test_server_level_cache(tmp_path, monkeypatch):
+    # level files should be parsed once, and parsed again when they change
+    import server
+    monkeypatch.setattr(server, "LOCATION", str(tmp_path))
+    monkeypatch.setattr(server, "LEVEL_CACHE", {})
+    os.mkdir(os.path.join(tmp_path, "puzzles"))
+    filename = os.path.join(tmp_path, "puzzles", "level.json")
+    old = [[["player"], [], ["computer"], ["target"]]]
+    new = [[["target"], ["computer"], [], ["player"]]]
+    with open(filename, "w") as f:
+        json.dump(old, f)
+    os.utime(filename, (1000, 1000))
+    level = server.load_level({"level": "level.json"})
+    assert level == old
+    assert server.load_level({"level": "level.json"}) is level
+
+    with open(filename, "w") as f:
+        json.dump(new, f)
+    # still cached while the modification time is the same
+    os.utime(filename, (1000, 1000))
+    assert server.load_level({"level": "level.json"}) is level
+    os.utime(filename, (2000, 2000))
+    assert server.load_level({"level": "level.json"}) == new
+    assert server.LEVEL_CACHE[filename][0] == 2000
+
 if __name__ == "__main__":
     import os
     import sys
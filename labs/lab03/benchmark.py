@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Benchmark map building and routing on the datasets in resources/, and write
+the results as JSON, so that runs before and after a change can be compared.
+
+Example usage:
+    python3 benchmark.py                              # mit, cambridge, midwest
+    python3 benchmark.py --queries 500 --seed 1 mit
+    python3 benchmark.py --modes lab bidirectional ch --output after.json
+    python3 benchmark.py --ch-max-nodes 0 midwest     # contraction hierarchy too
+
+For each dataset, in a fresh worker process:
+    build: seconds to compile the graph from the OSM files and to load it from
+        its .graph cache, the size of its arrays, and the peak memory use of
+        the process so far
+    preprocessing: seconds to prepare the landmark tables and contraction
+        hierarchies (only for the modes that use them), and their size
+    queries: for shortest ('short') and fastest ('fast') paths, latency
+        percentiles (in milliseconds) and nodes popped per query, for each
+        mode, over the same seeded random pairs of nodes
+
+The modes are 'lab' (lab.find_short_path and lab.find_fast_path, as called
+by the server, without preprocessing) and each search method in
+routing.methods, called directly on node indices.
+
+Building a contraction hierarchy is pure Python and grows faster than
+linearly with the size of the map, so by default the 'ch' mode is skipped on
+maps with more than CH_MAX_NODES nodes; skipped modes are listed, with the
+reason, under 'skipped' in the dataset's record.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import multiprocessing
+
+import lab
+import graph
+import routing
+import hierarchy
+import landmarks
+
+from util import percentile
+
+LOCATION = os.path.realpath(os.path.dirname(__file__))
+RESOURCES = os.path.join(LOCATION, 'resources')
+DATASETS = ('mit', 'cambridge', 'midwest')
+MODES = ('lab',) + tuple(routing.methods)
+METRICS = {'short': 'lengths', 'fast': 'times'}
+
+# largest map (in nodes) the 'ch' mode is run on by default; a hierarchy for
+# 10,000 nodes takes around ten seconds to build
+CH_MAX_NODES = 10000
+
+
+def max_rss_mb():
+    """
+    Return the peak resident memory of this process so far, in megabytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1 << 20 if sys.platform == 'darwin' else 1 << 10)
+
+
+def array_bytes(arrays):
+    """
+    Return the total size of the array buffers in a dictionary of arrays
+    (such as a graph, a hierarchy or a set of landmark tables).
+    """
+    return sum(
+        value.itemsize * len(value)
+        for value in arrays.values()
+        if hasattr(value, 'itemsize')
+    )
+
+
+def summarize(latencies, popped, found):
+    """
+    Summarize the latencies (in seconds) and nodes popped of a run of queries.
+    """
+    latencies = sorted(seconds * 1000 for seconds in latencies)
+    return {
+        'queries': len(latencies),
+        'found': found,
+        'latency_ms': {
+            'mean': sum(latencies) / len(latencies) if latencies else None,
+            'p50': percentile(latencies, 0.5),
+            'p90': percentile(latencies, 0.9),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else None,
+        },
+        'popped': {
+            'mean': sum(popped) / len(popped) if popped else None,
+            'max': max(popped, default=None),
+        },
+    }
+
+
+def run_queries(map_rep, pairs, kind, mode):
+    """
+    Answer every (source, target) pair of node indices with the given mode,
+    for shortest (kind 'short') or fastest (kind 'fast') paths, and return
+    the summary of the run.
+    """
+    metric = METRICS[kind]
+    if mode == 'lab':
+        func = lab.find_short_path if kind == 'short' else lab.find_fast_path
+    latencies, popped = [], []
+    found = 0
+    for source, target in pairs:
+        stats = {}
+        if mode == 'lab':
+            loc1 = graph.node_location(map_rep, source)
+            loc2 = graph.node_location(map_rep, target)
+            start = time.perf_counter()
+            path = func(map_rep, loc1, loc2, stats)
+        else:
+            start = time.perf_counter()
+            path = routing.find_path(map_rep, source, target, metric, stats, mode)
+        latencies.append(time.perf_counter() - start)
+        popped.append(stats.get('popped', 0))
+        found += path is not None
+    return summarize(latencies, popped, found)
+
+
+def benchmark_dataset(task):
+    """
+    Benchmark one dataset in a worker process, and return its report record.
+    task is a (dataset name, number of queries, seed, modes, largest map for
+    the 'ch' mode) tuple.
+    """
+    name, queries, seed, modes, ch_max_nodes = task
+    record = {'dataset': name}
+    nodes_filename = os.path.join(RESOURCES, f'{name}.nodes')
+    ways_filename = os.path.join(RESOURCES, f'{name}.ways')
+    try:
+        start = time.perf_counter()
+        graph.compile_graph(nodes_filename, ways_filename,
+                            lab.ALLOWED_HIGHWAY_TYPES, lab.DEFAULT_SPEED_LIMIT_MPH)
+        compile_seconds = time.perf_counter() - start
+        # make sure the cache is up to date, so the load below is warm
+        lab.build_internal_representation(nodes_filename, ways_filename)
+        start = time.perf_counter()
+        map_rep = lab.build_internal_representation(nodes_filename, ways_filename)
+        load_seconds = time.perf_counter() - start
+        record['build'] = {
+            'compile_seconds': compile_seconds,
+            'load_seconds': load_seconds,
+            'nodes': len(map_rep['ids']),
+            'edges': len(map_rep['targets']),
+            'graph_bytes': array_bytes(map_rep),
+            'max_rss_mb': max_rss_mb(),
+        }
+
+        # the same pairs for every mode, so their results can be compared
+        rng = random.Random(seed)
+        n = len(map_rep['ids'])
+        pairs = [(rng.randrange(n), rng.randrange(n)) for _ in range(queries)] if n else []
+        record['queries'] = {kind: {} for kind in METRICS}
+        for mode in modes:
+            if mode == 'ch' and ch_max_nodes and n > ch_max_nodes:
+                record.setdefault('skipped', {})[mode] = f'more than {ch_max_nodes} nodes'
+                continue
+            if mode == 'alt' and 'landmarks' not in map_rep:
+                start = time.perf_counter()
+                tables = landmarks.prepare_landmarks(map_rep)
+                record.setdefault('preprocessing', {})['alt'] = {
+                    'seconds': time.perf_counter() - start,
+                    'bytes': array_bytes(tables),
+                }
+            if mode == 'ch' and 'hierarchies' not in map_rep:
+                start = time.perf_counter()
+                hierarchies = hierarchy.prepare_hierarchies(map_rep)
+                record.setdefault('preprocessing', {})['ch'] = {
+                    'seconds': time.perf_counter() - start,
+                    'bytes': sum(array_bytes(h) for h in hierarchies.values()),
+                }
+            if mode == 'lab':
+                # without preprocessing, whatever order the modes come in
+                attached = {key: map_rep.pop(key) for key in ('landmarks', 'hierarchies') if key in map_rep}
+            for kind in METRICS:
+                record['queries'][kind][mode] = run_queries(map_rep, pairs, kind, mode)
+            if mode == 'lab':
+                map_rep.update(attached)
+        record['max_rss_mb'] = max_rss_mb()
+        record['status'] = 'ok'
+    except Exception as e:
+        record['status'] = 'error'
+        record['error'] = repr(e)
+    return record
+
+
+def run_benchmarks(datasets=DATASETS, queries=200, seed=6009, modes=MODES,
+                   ch_max_nodes=CH_MAX_NODES, verbose=False):
+    """
+    Benchmark the named datasets one after another, each in a fresh worker
+    process (so that their peak memory use is measured separately and they
+    do not compete for the CPU), and return the report as a dictionary.  The
+    'ch' mode is skipped on maps with more than ch_max_nodes nodes (if it is
+    not 0 or None).  If verbose is True, print a line as each dataset
+    finishes.
+    """
+    tasks = [(name, queries, seed, tuple(modes), ch_max_nodes) for name in datasets]
+    records = []
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        for record in pool.imap(benchmark_dataset, tasks):
+            records.append(record)
+            if verbose:
+                print(f"[{len(records)}/{len(tasks)}] {record['dataset']}: {record['status']}", flush=True)
+    return {
+        'settings': {
+            'queries': queries,
+            'seed': seed,
+            'modes': list(modes),
+            'ch_max_nodes': ch_max_nodes,
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+        },
+        'results': records,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark map building and routing.')
+    parser.add_argument('--queries', type=int, default=200, help='random queries per mode and path type')
+    parser.add_argument('--seed', type=int, default=6009, help='seed for the random queries')
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=MODES)
+    parser.add_argument('--ch-max-nodes', type=int, default=CH_MAX_NODES,
+                        help="skip the 'ch' mode on larger maps (0 for no limit)")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('datasets', nargs='*', help='dataset names in resources/ (default: %s)' % ', '.join(DATASETS))
+    parsed = parser.parse_args()
+
+    report = run_benchmarks(parsed.datasets or DATASETS, parsed.queries, parsed.seed,
+                            parsed.modes, parsed.ch_max_nodes, verbose=True)
+    with open(parsed.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for record in report['results']:
+        if record['status'] != 'ok':
+            print(f"{record['dataset']}: {record['error']}")
+            continue
+        build = record['build']
+        print(f"{record['dataset']}: {build['nodes']} nodes, {build['edges']} edges, "
+              f"compiled in {build['compile_seconds']:.2f}s, loaded in {build['load_seconds']:.2f}s")
+        for kind, by_mode in record['queries'].items():
+            for mode, summary in by_mode.items():
+                latency = summary['latency_ms']
+                print(f"  {kind:5} {mode:13} p50 {latency['p50'] or 0:8.2f}ms  "
+                      f"p99 {latency['p99'] or 0:8.2f}ms  popped {summary['popped']['mean'] or 0:10.1f}")
+        for mode, reason in record.get('skipped', {}).items():
+            print(f'  {mode} skipped: {reason}')
+    print(f'report written to {parsed.output}')
+    sys.exit(0 if all(record['status'] == 'ok' for record in report['results']) else 1)
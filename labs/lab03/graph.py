@@ -0,0 +1,415 @@
+"""
+Compact road graphs for 6.009 lab 3.
+
+A graph is stored in compressed sparse row (CSR) form: OSM node ids are
+remapped to dense indices 0..n-1 (in increasing id order), and the outgoing
+edges of node i are the entries offsets[i] to offsets[i+1]-1 of the per-edge
+arrays.  All arrays are array.array buffers, so a graph costs a few dozen
+bytes per edge instead of a dictionary per node.
+
+Compiled graphs are cached in a '.graph' file next to the '.nodes' file they
+were built from, so later runs can load them without re-reading the OSM data.
+Loading a graph also builds a spatial index over its nodes (see spatial.py),
+which is cheap enough to rebuild on every load.
+
+A graph also records which edges each OSM way became, so that the speeds of
+individual ways can be changed in place (see traffic.py).
+"""
+import os
+import pickle
+import hashlib
+from array import array
+from bisect import bisect_left
+
+import spatial
+from osm_binary import is_binary, open_binary
+from util import read_osm_data, great_circle_distance
+
+# bump this whenever the layout of a compiled graph changes, so that stale
+# cache files are rebuilt instead of misread
+GRAPH_VERSION = 2
+
+# per-node and per-edge arrays of a graph, with their array typecodes
+NODE_ARRAYS = (('ids', 'q'), ('lat', 'd'), ('lon', 'd'), ('offsets', 'q'))
+EDGE_ARRAYS = (('targets', 'i'), ('lengths', 'd'), ('speeds', 'd'), ('times', 'd'))
+# per-way arrays, mapping OSM ways to the edges they became
+WAY_ARRAYS = (('way_ids', 'q'), ('way_speeds', 'd'), ('way_offsets', 'q'), ('way_edges', 'q'))
+
+
+def cache_filename(nodes_filename):
+    """
+    Return the name of the compiled graph cache file for the given .nodes file.
+    """
+    return os.path.splitext(nodes_filename)[0] + '.graph'
+
+
+def _source_signature(nodes_filename, ways_filename, allowed_highway_types, default_speeds):
+    """
+    Describe everything a compiled graph depends on, so that a cache file can
+    be checked against it.
+    """
+    files = []
+    for filename in (nodes_filename, ways_filename):
+        st = os.stat(filename)
+        files.append((os.path.basename(filename), st.st_size, st.st_mtime_ns))
+    return {
+        'version': GRAPH_VERSION,
+        'files': files,
+        'highway_types': sorted(allowed_highway_types),
+        'speeds': sorted(default_speeds.items()),
+    }
+
+
+def compile_graph(nodes_filename, ways_filename, allowed_highway_types, default_speeds):
+    """
+    Build a graph from the OSM data in the given files.
+
+    Only ways whose 'highway' tag is in allowed_highway_types are used.  Each
+    pair of consecutive nodes on a way becomes an edge (in both directions,
+    unless the way is tagged oneway=yes), and nodes that are not on any such
+    way are left out.  The speed limit of a way is its 'maxspeed_mph' tag if
+    it has one, and default_speeds[highway type] otherwise; if several ways
+    join the same two nodes, the edge gets the highest speed limit.
+
+    The files are read in two streaming passes: the ways first, to find the
+    node ids that are actually on allowed ways, and then the nodes, keeping
+    the coordinates of those nodes only.  Everything kept along the way is
+    stored in arrays, so memory use grows with the size of the road network
+    rather than with the size of the extract.
+
+    Returns a dictionary with the arrays listed in NODE_ARRAYS, EDGE_ARRAYS
+    and WAY_ARRAYS:
+        ids: OSM id of each node (sorted)
+        lat, lon: coordinates of each node
+        offsets: CSR row offsets (n + 1 entries)
+        targets: index of the node each edge leads to
+        lengths: length of each edge, in miles
+        speeds: speed limit of each edge, in miles per hour
+        times: time to travel each edge at its speed limit, in hours
+        way_ids: OSM id of each allowed way (sorted)
+        way_speeds: speed limit of each way, in miles per hour
+        way_offsets: the edges of way w are entries way_offsets[w] to
+            way_offsets[w+1]-1 of way_edges
+        way_edges: edge indices, grouped by way
+    """
+    # pass 1: the edges of allowed ways, as OSM id pairs
+    edge_sources = array('q')
+    edge_targets = array('q')
+    edge_speeds = array('d')
+    edge_ways = array('q')
+    found_way_ids = array('q')
+    found_way_speeds = array('d')
+    wanted = set()
+    for way in read_osm_data(ways_filename):
+        tags = way['tags']
+        highway = tags.get('highway')
+        if highway not in allowed_highway_types:
+            continue
+        speed = tags.get('maxspeed_mph', default_speeds[highway])
+        oneway = tags.get('oneway') == 'yes'
+        w = len(found_way_ids)
+        found_way_ids.append(way['id'])
+        found_way_speeds.append(speed)
+        nodes = way['nodes']
+        for a, b in zip(nodes, nodes[1:]):
+            if a == b:
+                continue
+            wanted.add(a)
+            wanted.add(b)
+            edge_sources.append(a)
+            edge_targets.append(b)
+            edge_speeds.append(speed)
+            edge_ways.append(w)
+            if not oneway:
+                edge_sources.append(b)
+                edge_targets.append(a)
+                edge_speeds.append(speed)
+                edge_ways.append(w)
+
+    # pass 2: the coordinates of the nodes on those edges
+    found_ids = array('q')
+    found_lat = array('d')
+    found_lon = array('d')
+    if is_binary(nodes_filename):
+        # read the columns straight from the mapped file, without building
+        # a dictionary per node
+        with open_binary(nodes_filename) as data:
+            columns = zip(data.columns['ids'], data.columns['lat'], data.columns['lon'])
+            for node_id, node_lat, node_lon in columns:
+                if node_id in wanted:
+                    found_ids.append(node_id)
+                    found_lat.append(node_lat)
+                    found_lon.append(node_lon)
+            del columns
+    else:
+        for node in read_osm_data(nodes_filename):
+            if node['id'] in wanted:
+                found_ids.append(node['id'])
+                found_lat.append(node['lat'])
+                found_lon.append(node['lon'])
+    del wanted
+
+    # edges whose endpoints are missing from the nodes file cannot be used;
+    # among the others, only nodes that end up on an edge are kept
+    found = {node_id: i for i, node_id in enumerate(found_ids)}
+    used = set()
+    for a, b in zip(edge_sources, edge_targets):
+        if a in found and b in found:
+            used.add(a)
+            used.add(b)
+    order = sorted((found[node_id] for node_id in used), key=found_ids.__getitem__)
+    del used
+    ids = array('q', (found_ids[i] for i in order))
+    lat = array('d', (found_lat[i] for i in order))
+    lon = array('d', (found_lon[i] for i in order))
+    del found_ids, found_lat, found_lon, order
+    index = {node_id: i for i, node_id in enumerate(ids)}
+    del found
+
+    # sort the edges by (source, target) index, merging repeated edges
+    n = len(ids)
+    keys = array('q')
+    speeds = array('d')
+    ways = array('q')
+    for a, b, speed, w in zip(edge_sources, edge_targets, edge_speeds, edge_ways):
+        if a in index and b in index:
+            keys.append(index[a] * n + index[b])
+            speeds.append(speed)
+            ways.append(w)
+    del edge_sources, edge_targets, edge_speeds, edge_ways
+
+    graph = {
+        'ids': ids,
+        'lat': lat,
+        'lon': lon,
+        'offsets': array('q', bytes(8 * (n + 1))),
+        'targets': array('i'),
+        'lengths': array('d'),
+        'speeds': array('d'),
+        'times': array('d'),
+    }
+    offsets = graph['offsets']
+    # way_keys[j] identifies the j-th (way, edge) pair, as way * m + edge
+    m = len(keys)
+    way_keys = array('q')
+    previous = None
+    for e in sorted(range(len(keys)), key=keys.__getitem__):
+        key = keys[e]
+        way_keys.append(ways[e] * m + len(graph['targets']) - (key == previous))
+        if key == previous:
+            if graph['speeds'][-1] < speeds[e]:
+                graph['speeds'][-1] = speeds[e]
+                graph['times'][-1] = graph['lengths'][-1] / speeds[e]
+            continue
+        previous = key
+        a, b = divmod(key, n)
+        length = great_circle_distance((lat[a], lon[a]), (lat[b], lon[b]))
+        offsets[a + 1] += 1
+        graph['targets'].append(b)
+        graph['lengths'].append(length)
+        graph['speeds'].append(speeds[e])
+        graph['times'].append(length / speeds[e])
+    for i in range(n):
+        offsets[i + 1] += offsets[i]
+    del keys, speeds, ways
+
+    # group the edges by way, in way id order
+    way_order = sorted(range(len(found_way_ids)), key=found_way_ids.__getitem__)
+    rank = array('q', bytes(8 * len(way_order)))
+    for r, w in enumerate(way_order):
+        rank[w] = r
+    graph['way_ids'] = array('q', (found_way_ids[w] for w in way_order))
+    graph['way_speeds'] = array('d', (found_way_speeds[w] for w in way_order))
+    way_offsets = graph['way_offsets'] = array('q', bytes(8 * (len(way_order) + 1)))
+    graph['way_edges'] = array('q')
+    previous = None
+    for key in sorted(rank[w] * m + e for w, e in (divmod(key, m) for key in way_keys)):
+        # a way that passes the same pair of nodes twice only lists it once
+        if key != previous:
+            previous = key
+            w, e = divmod(key, m)
+            way_offsets[w + 1] += 1
+            graph['way_edges'].append(e)
+    for w in range(len(way_order)):
+        way_offsets[w + 1] += way_offsets[w]
+    return graph
+
+
+def save_arrays(arrays, layout, filename, signature):
+    """
+    Write the arrays named in layout (a sequence of (name, typecode) pairs)
+    from the dictionary arrays to the given file: a pickled header (signature
+    and array lengths), followed by the raw contents of each array.
+
+    The file is written under a temporary name and then renamed, so readers
+    never see a partially written file.
+    """
+    names = [name for name, _ in layout]
+    header = dict(signature, lengths={name: len(arrays[name]) for name in names})
+    temp_filename = f'{filename}.{os.getpid()}.tmp'
+    with open(temp_filename, 'wb') as f:
+        pickle.dump(header, f)
+        for name in names:
+            arrays[name].tofile(f)
+    os.replace(temp_filename, filename)
+
+
+def read_arrays(filename, layout, signature):
+    """
+    Read a dictionary of arrays written by save_arrays with the same layout,
+    or return None if the file does not exist or its header does not match
+    the given signature.
+    """
+    try:
+        f = open(filename, 'rb')
+    except FileNotFoundError:
+        return None
+    with f:
+        try:
+            header = pickle.load(f)
+        except Exception:
+            return None
+        if any(header.get(key) != value for key, value in signature.items()):
+            return None
+        arrays = {}
+        for name, typecode in layout:
+            arrays[name] = array(typecode)
+            arrays[name].fromfile(f, header['lengths'][name])
+    return arrays
+
+
+def save_graph(graph, filename, signature):
+    """
+    Write a compiled graph to the given file (see save_arrays).
+    """
+    save_arrays(graph, NODE_ARRAYS + EDGE_ARRAYS + WAY_ARRAYS, filename, signature)
+
+
+def read_graph(filename, signature):
+    """
+    Read a compiled graph written by save_graph, or return None if the file
+    does not exist or was built from different data or settings.
+    """
+    return read_arrays(filename, NODE_ARRAYS + EDGE_ARRAYS + WAY_ARRAYS, signature)
+
+
+def graph_fingerprint(graph):
+    """
+    Return a hex digest of the contents of a graph, identifying the data that
+    preprocessed accelerators (such as contraction hierarchies) were built
+    from.
+    """
+    digest = hashlib.sha256(str(GRAPH_VERSION).encode())
+    for name, _ in NODE_ARRAYS + EDGE_ARRAYS:
+        digest.update(graph[name].tobytes())
+    return digest.hexdigest()
+
+
+def load_graph(nodes_filename, ways_filename, allowed_highway_types, default_speeds):
+    """
+    Return the graph for the given OSM files (see compile_graph), loading it
+    from the cache file if that is up to date, and compiling and caching it
+    otherwise.  Failing to write the cache (e.g. in a read-only directory) is
+    not an error.
+    """
+    signature = _source_signature(
+        nodes_filename, ways_filename, allowed_highway_types, default_speeds
+    )
+    filename = cache_filename(nodes_filename)
+    graph = read_graph(filename, signature)
+    if graph is None:
+        graph = compile_graph(
+            nodes_filename, ways_filename, allowed_highway_types, default_speeds
+        )
+        try:
+            save_graph(graph, filename, signature)
+        except OSError:
+            pass
+    spatial_index(graph)
+    return graph
+
+
+def node_index(graph, node_id):
+    """
+    Return the dense index of the node with the given OSM id, or None if it is
+    not in the graph.
+    """
+    ids = graph['ids']
+    i = bisect_left(ids, node_id)
+    if i < len(ids) and ids[i] == node_id:
+        return i
+    return None
+
+
+def node_location(graph, i):
+    """
+    Return the (latitude, longitude) of the node with dense index i.
+    """
+    return (graph['lat'][i], graph['lon'][i])
+
+
+def reverse_adjacency(graph):
+    """
+    Return the incoming edges of every node, in CSR form, building them the
+    first time they are needed: a dictionary with
+        offsets: the incoming edges of node i are entries offsets[i] to
+            offsets[i+1]-1 of the other arrays
+        sources: the node each incoming edge comes from
+        edges: the index of each incoming edge in the graph's edge arrays, so
+            that any of its per-edge weights can be looked up
+    One-way streets only appear in the direction they can be driven.
+    """
+    if 'reverse' not in graph:
+        n = len(graph['ids'])
+        offsets, targets = graph['offsets'], graph['targets']
+        sources = array('i', bytes(4 * len(targets)))
+        for node in range(n):
+            for e in range(offsets[node], offsets[node + 1]):
+                sources[e] = node
+        order = sorted(range(len(targets)), key=targets.__getitem__)
+        reverse_offsets = array('q', bytes(8 * (n + 1)))
+        for target in targets:
+            reverse_offsets[target + 1] += 1
+        for node in range(n):
+            reverse_offsets[node + 1] += reverse_offsets[node]
+        graph['reverse'] = {
+            'offsets': reverse_offsets,
+            'sources': array('i', (sources[e] for e in order)),
+            'edges': array('q', order),
+        }
+    return graph['reverse']
+
+
+def spatial_index(graph):
+    """
+    Return the grid index (see spatial.py) over the nodes of the graph,
+    building it the first time it is needed.
+    """
+    if 'grid' not in graph:
+        graph['grid'] = spatial.build_grid(graph['lat'], graph['lon'])
+    return graph['grid']
+
+
+def nearest_node(graph, loc):
+    """
+    Return the dense index of the node closest to the given (latitude,
+    longitude) location, or None if the graph is empty.
+    """
+    nearest = nearest_nodes(graph, loc, 1)
+    return nearest[0] if nearest else None
+
+
+def nearest_nodes(graph, loc, k):
+    """
+    Return the dense indices of the k nodes closest to the given location,
+    closest first.
+    """
+    return spatial.nearest_nodes(spatial_index(graph), graph['lat'], graph['lon'], loc, k)
+
+
+def nodes_within(graph, loc, radius):
+    """
+    Return the dense indices of the nodes within radius miles of the given
+    location, closest first.
+    """
+    return spatial.nodes_within(spatial_index(graph), graph['lat'], graph['lon'], loc, radius)
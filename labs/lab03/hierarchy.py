@@ -0,0 +1,340 @@
+"""
+Contraction hierarchies for the compact graphs built by graph.py.
+
+Preprocessing contracts the nodes one at a time, from least to most
+important.  Contracting a node removes it from the graph, adding a shortcut
+edge u -> w (through the node) wherever the path u -> node -> w might be the
+only shortest path from u to w.  A node's rank is its position in this order.
+
+Every shortest path then has a version that only goes up in rank and then
+only down, so a query runs Dijkstra's algorithm forward from the source over
+edges leading to higher ranks, and backward from the target over edges
+coming from higher ranks, and joins the two at the best meeting node.
+Shortcuts along the result are unpacked back into the original edges.
+
+A hierarchy for one metric is a dictionary of the arrays in HIERARCHY_ARRAYS:
+    rank: rank of each node
+    up_offsets, up_targets, up_weights, up_middles: for node v, the edges
+        v -> w with rank[w] > rank[v], in CSR form
+    down_offsets, down_sources, down_weights, down_middles: for node v, the
+        edges u -> v with rank[u] > rank[v], in CSR form
+A middle of -1 marks an original edge; otherwise the edge is a shortcut made
+when that middle node was contracted.
+"""
+import os
+import heapq
+from array import array
+
+from graph import save_arrays, read_arrays, graph_fingerprint
+
+HIERARCHY_VERSION = 1
+HIERARCHY_ARRAYS = (
+    ('rank', 'i'),
+    ('up_offsets', 'q'), ('up_targets', 'i'), ('up_weights', 'd'), ('up_middles', 'i'),
+    ('down_offsets', 'q'), ('down_sources', 'i'), ('down_weights', 'd'), ('down_middles', 'i'),
+)
+METRICS = ('lengths', 'times')
+
+# witness searches give up after settling this many nodes, adding a shortcut
+# that may not be needed (which is safe, just less compact)
+WITNESS_SETTLE_LIMIT = 60
+
+INF = float('inf')
+
+
+def hierarchy_filename(nodes_filename):
+    """
+    Return the name of the contraction hierarchy file for the given .nodes
+    file.
+    """
+    return os.path.splitext(nodes_filename)[0] + '.ch'
+
+
+def _witness_distances(out_edges, source, skip, max_cost):
+    """
+    Run a limited Dijkstra search from source that does not go through skip,
+    and return the distances it found (which are upper bounds on the true
+    distances in the remaining graph).
+    """
+    distances = {source: 0.0}
+    agenda = [(0.0, source)]
+    settled = 0
+    while agenda:
+        cost, node = heapq.heappop(agenda)
+        if cost > distances[node]:
+            continue
+        if cost > max_cost or settled == WITNESS_SETTLE_LIMIT:
+            break
+        settled += 1
+        for neighbor, (weight, _) in out_edges[node].items():
+            if neighbor == skip:
+                continue
+            new_cost = cost + weight
+            if new_cost < distances.get(neighbor, INF):
+                distances[neighbor] = new_cost
+                heapq.heappush(agenda, (new_cost, neighbor))
+    return distances
+
+
+def _shortcuts(out_edges, in_edges, node):
+    """
+    Return the (u, w, weight) shortcuts needed to contract node.
+    """
+    shortcuts = []
+    outgoing = out_edges[node]
+    if not outgoing:
+        return shortcuts
+    max_out = max(weight for weight, _ in outgoing.values())
+    for u, (in_weight, _) in in_edges[node].items():
+        distances = _witness_distances(out_edges, u, node, in_weight + max_out)
+        for w, (out_weight, _) in outgoing.items():
+            if w != u and distances.get(w, INF) > in_weight + out_weight:
+                shortcuts.append((u, w, in_weight + out_weight))
+    return shortcuts
+
+
+def _priority(out_edges, in_edges, deleted, node):
+    # edge difference, plus the number of contracted neighbors so that
+    # contraction spreads evenly over the graph
+    removed = len(out_edges[node]) + len(in_edges[node])
+    return len(_shortcuts(out_edges, in_edges, node)) - removed + deleted[node]
+
+
+def _to_csr(n, edges, endpoint_name, prefix):
+    """
+    Pack per-node lists of (endpoint, weight, middle) edges into CSR arrays.
+    """
+    arrays = {
+        f'{prefix}_offsets': array('q', bytes(8 * (n + 1))),
+        endpoint_name: array('i'),
+        f'{prefix}_weights': array('d'),
+        f'{prefix}_middles': array('i'),
+    }
+    offsets = arrays[f'{prefix}_offsets']
+    for node in range(n):
+        for endpoint, weight, middle in edges[node]:
+            arrays[endpoint_name].append(endpoint)
+            arrays[f'{prefix}_weights'].append(weight)
+            arrays[f'{prefix}_middles'].append(middle)
+        offsets[node + 1] = len(arrays[endpoint_name])
+    return arrays
+
+
+def build_hierarchy(graph, metric):
+    """
+    Build the contraction hierarchy of the graph for the given metric
+    ('lengths' or 'times').
+    """
+    n = len(graph['ids'])
+    offsets, targets, weights = graph['offsets'], graph['targets'], graph[metric]
+    out_edges = [{} for _ in range(n)]
+    in_edges = [{} for _ in range(n)]
+    for u in range(n):
+        for e in range(offsets[u], offsets[u + 1]):
+            w = targets[e]
+            if weights[e] < out_edges[u].get(w, (INF,))[0]:
+                out_edges[u][w] = in_edges[w][u] = (weights[e], -1)
+
+    deleted = [0] * n
+    agenda = [(_priority(out_edges, in_edges, deleted, node), node) for node in range(n)]
+    heapq.heapify(agenda)
+    rank = array('i', bytes(4 * n))
+    up = [None] * n
+    down = [None] * n
+    next_rank = 0
+    while agenda:
+        _, node = heapq.heappop(agenda)
+        # priorities go stale as neighbors are contracted; recompute lazily
+        priority = _priority(out_edges, in_edges, deleted, node)
+        if agenda and priority > agenda[0][0]:
+            heapq.heappush(agenda, (priority, node))
+            continue
+
+        for u, w, weight in _shortcuts(out_edges, in_edges, node):
+            if weight < out_edges[u].get(w, (INF,))[0]:
+                out_edges[u][w] = in_edges[w][u] = (weight, node)
+        rank[node] = next_rank
+        next_rank += 1
+        up[node] = [(w, weight, middle) for w, (weight, middle) in out_edges[node].items()]
+        down[node] = [(u, weight, middle) for u, (weight, middle) in in_edges[node].items()]
+        for w in out_edges[node]:
+            del in_edges[w][node]
+            deleted[w] += 1
+        for u in in_edges[node]:
+            del out_edges[u][node]
+            deleted[u] += 1
+        out_edges[node] = {}
+        in_edges[node] = {}
+
+    hierarchy = {'rank': rank}
+    hierarchy.update(_to_csr(n, up, 'up_targets', 'up'))
+    hierarchy.update(_to_csr(n, down, 'down_sources', 'down'))
+    return hierarchy
+
+
+def _layout(metrics):
+    return tuple(
+        (f'{metric}.{name}', typecode)
+        for metric in metrics
+        for name, typecode in HIERARCHY_ARRAYS
+    )
+
+
+def save_hierarchies(graph, filename):
+    """
+    Write the hierarchies attached to the graph to the given file.
+    """
+    hierarchies = graph['hierarchies']
+    metrics = tuple(sorted(hierarchies))
+    arrays = {
+        f'{metric}.{name}': hierarchies[metric][name]
+        for metric in metrics
+        for name, _ in HIERARCHY_ARRAYS
+    }
+    signature = {
+        'version': HIERARCHY_VERSION,
+        'graph': graph_fingerprint(graph),
+        'metrics': metrics,
+    }
+    save_arrays(arrays, _layout(metrics), filename, signature)
+
+
+def read_hierarchies(graph, filename, metrics=METRICS):
+    """
+    Read the hierarchies for the given metrics from a file written by
+    save_hierarchies, or return None if the file does not exist or was built
+    for a different graph.
+    """
+    metrics = tuple(sorted(metrics))
+    signature = {
+        'version': HIERARCHY_VERSION,
+        'graph': graph_fingerprint(graph),
+        'metrics': metrics,
+    }
+    arrays = read_arrays(filename, _layout(metrics), signature)
+    if arrays is None:
+        return None
+    return {
+        metric: {name: arrays[f'{metric}.{name}'] for name, _ in HIERARCHY_ARRAYS}
+        for metric in metrics
+    }
+
+
+def prepare_hierarchies(graph, filename=None, metrics=METRICS):
+    """
+    Attach contraction hierarchies for the given metrics to the graph (as
+    graph['hierarchies']), so that routing.find_path uses them.
+
+    If filename is given, the hierarchies are loaded from that file when it
+    matches the graph, and built and saved there otherwise.
+    """
+    hierarchies = None
+    if filename is not None:
+        hierarchies = read_hierarchies(graph, filename, metrics)
+    if hierarchies is None:
+        graph['hierarchies'] = {metric: build_hierarchy(graph, metric) for metric in metrics}
+        if filename is not None:
+            try:
+                save_hierarchies(graph, filename)
+            except OSError:
+                pass
+    else:
+        graph['hierarchies'] = hierarchies
+    return graph['hierarchies']
+
+
+def _find_edge(endpoints, offsets, node, endpoint):
+    for e in range(offsets[node], offsets[node + 1]):
+        if endpoints[e] == endpoint:
+            return e
+    raise KeyError((node, endpoint))
+
+
+def _unpack(hierarchy, u, w, middle, path):
+    """
+    Append the nodes after u on the original-edge path of the edge u -> w
+    (with the given middle) to path.
+    """
+    stack = [(u, w, middle)]
+    while stack:
+        u, w, middle = stack.pop()
+        if middle == -1:
+            path.append(w)
+            continue
+        # the middle node was contracted before both ends, so u -> middle is
+        # one of its down edges and middle -> w one of its up edges
+        first = _find_edge(hierarchy['down_sources'], hierarchy['down_offsets'], middle, u)
+        second = _find_edge(hierarchy['up_targets'], hierarchy['up_offsets'], middle, w)
+        stack.append((middle, w, hierarchy['up_middles'][second]))
+        stack.append((u, middle, hierarchy['down_middles'][first]))
+
+
+def query(graph, source, target, metric, stats=None):
+    """
+    Find a minimum-cost path from node source to node target with a
+    bidirectional upward search over the graph's hierarchy for the metric.
+
+    Returns the list of node indices along the path, or None if target cannot
+    be reached from source.
+    """
+    hierarchy = graph['hierarchies'][metric]
+    searches = (
+        (hierarchy['up_offsets'], hierarchy['up_targets'],
+         hierarchy['up_weights'], hierarchy['up_middles']),
+        (hierarchy['down_offsets'], hierarchy['down_sources'],
+         hierarchy['down_weights'], hierarchy['down_middles']),
+    )
+    best = ({source: 0.0}, {target: 0.0})
+    parent = ({source: None}, {target: None})
+    agendas = ([(0.0, source)], [(0.0, target)])
+    meeting, meeting_cost = None, INF
+    if source == target:
+        meeting, meeting_cost = source, 0.0
+    popped = relaxed = 0
+    while agendas[0] or agendas[1]:
+        # a direction is finished once nothing left on its agenda can lead
+        # to a cheaper meeting
+        for side in (0, 1):
+            if agendas[side] and agendas[side][0][0] >= meeting_cost:
+                agendas[side].clear()
+        side = 0 if agendas[0] and (not agendas[1] or agendas[0][0] <= agendas[1][0]) else 1
+        if not agendas[side]:
+            break
+        cost, node = heapq.heappop(agendas[side])
+        if cost > best[side][node]:
+            continue
+        popped += 1
+        if node in best[1 - side] and cost + best[1 - side][node] < meeting_cost:
+            meeting, meeting_cost = node, cost + best[1 - side][node]
+        offsets, endpoints, weights, _ = searches[side]
+        for e in range(offsets[node], offsets[node + 1]):
+            neighbor = endpoints[e]
+            new_cost = cost + weights[e]
+            if new_cost < best[side].get(neighbor, INF):
+                best[side][neighbor] = new_cost
+                parent[side][neighbor] = (node, e)
+                relaxed += 1
+                heapq.heappush(agendas[side], (new_cost, neighbor))
+    if stats is not None:
+        stats['popped'] = stats.get('popped', 0) + popped
+        stats['relaxed'] = stats.get('relaxed', 0) + relaxed
+    if meeting is None:
+        return None
+
+    # the upward edges from source to the meeting node, and from the target
+    # back to it, each unpacked into original edges
+    forward = []
+    node = meeting
+    while parent[0][node] is not None:
+        previous, e = parent[0][node]
+        forward.append((previous, node, hierarchy['up_middles'][e]))
+        node = previous
+    path = [source]
+    for u, w, middle in reversed(forward):
+        _unpack(hierarchy, u, w, middle, path)
+    node = meeting
+    while parent[1][node] is not None:
+        following, e = parent[1][node]
+        _unpack(hierarchy, node, following, hierarchy['down_middles'][e], path)
+        node = following
+    return path
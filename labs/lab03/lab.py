@@ -5,6 +5,16 @@ from util import read_osm_data, great_circle_distance, to_local_kml_url
 
 # NO ADDITIONAL IMPORTS!
 
+# Unlike in lab 2, the map representation and the searches do not fit in this
+# file: they live in this lab's own modules next to util.py (graph.py,
+# routing.py and friends, which use standard library modules such as array,
+# bisect and heapq).  The functions below are thin wrappers around them, so
+# these imports are the one exception to the rule above.
+from graph import load_graph, node_index, node_location, nearest_node
+from routing import find_path, within_budget
+from matrix import cost_matrix
+from traffic import set_way_speeds
+
 
 ALLOWED_HIGHWAY_TYPES = {
     'motorway', 'trunk', 'primary', 'secondary', 'tertiary', 'unclassified',
@@ -34,11 +44,34 @@ def build_internal_representation(nodes_filename, ways_filename):
     """
     Create any internal representation you you want for the specified map, by
     reading the data from the given filenames (using read_osm_data)
+
+    The representation is the compact CSR graph described in graph.py, built
+    from the ways in ALLOWED_HIGHWAY_TYPES.  It is cached in a .graph file next
+    to the .nodes file, so only the first run pays for reading the OSM data.
+    """
+    return load_graph(nodes_filename, ways_filename,
+                      ALLOWED_HIGHWAY_TYPES, DEFAULT_SPEED_LIMIT_MPH)
+
+
+def update_way_speeds(map_rep, speeds):
     """
-    return None
+    Change the speeds of individual ways (e.g. from a live traffic feed),
+    without rebuilding the map.
 
+    Parameters:
+        map_rep: the result of calling build_internal_representation
+        speeds: dictionary mapping OSM way IDs to their new speed in miles per
+                hour (0 closes the way), or to None to restore the way's
+                speed limit
 
-def find_short_path_nodes(map_rep, node1, node2):
+    Returns:
+        the number of edges whose speed changed.  find_fast_path and the other
+        time-based queries use the new speeds straight away (see traffic.py).
+    """
+    return set_way_speeds(map_rep, speeds)
+
+
+def find_short_path_nodes(map_rep, node1, node2, stats=None):
     """
     Return the shortest path between the two nodes
 
@@ -46,15 +79,40 @@ def find_short_path_nodes(map_rep, node1, node2):
         map_rep: the result of calling build_internal_representation
         node1: node representing the start location
         node2: node representing the end location
+        stats: if given, a dictionary in which to count the work done by the
+               search (see routing.py)
 
     Returns:
         a list of node IDs representing the shortest path (in terms of
         distance) from node1 to node2
     """
-    raise NotImplementedError
+    source = node_index(map_rep, node1)
+    target = node_index(map_rep, node2)
+    if source is None or target is None:
+        return None
+    path = find_path(map_rep, source, target, 'lengths', stats)
+    if path is None:
+        return None
+    return [map_rep['ids'][i] for i in path]
+
+
+def find_path_locations(map_rep, loc1, loc2, metric, stats=None):
+    """
+    Snap both locations to their nearest nodes, and return the locations of
+    the nodes along a path between them minimizing the given metric ('lengths'
+    or 'times'), or None if there is no such path.
+    """
+    source = nearest_node(map_rep, loc1)
+    target = nearest_node(map_rep, loc2)
+    if source is None or target is None:
+        return None
+    path = find_path(map_rep, source, target, metric, stats)
+    if path is None:
+        return None
+    return [node_location(map_rep, i) for i in path]
 
 
-def find_short_path(map_rep, loc1, loc2):
+def find_short_path(map_rep, loc1, loc2, stats=None):
     """
     Return the shortest path between the two locations
 
@@ -64,15 +122,17 @@ def find_short_path(map_rep, loc1, loc2):
               location
         loc2: tuple of 2 floats: (latitude, longitude), representing the end
               location
+        stats: if given, a dictionary in which to count the work done by the
+               search (see routing.py)
 
     Returns:
         a list of (latitude, longitude) tuples representing the shortest path
         (in terms of distance) from loc1 to loc2.
     """
-    raise NotImplementedError
+    return find_path_locations(map_rep, loc1, loc2, 'lengths', stats)
 
 
-def find_fast_path(map_rep, loc1, loc2):
+def find_fast_path(map_rep, loc1, loc2, stats=None):
     """
     Return the shortest path between the two locations, in terms of expected
     time (taking into account speed limits).
@@ -83,12 +143,77 @@ def find_fast_path(map_rep, loc1, loc2):
               location
         loc2: tuple of 2 floats: (latitude, longitude), representing the end
               location
+        stats: if given, a dictionary in which to count the work done by the
+               search (see routing.py)
 
     Returns:
         a list of (latitude, longitude) tuples representing the shortest path
         (in terms of time) from loc1 to loc2.
     """
-    raise NotImplementedError
+    return find_path_locations(map_rep, loc1, loc2, 'times', stats)
+
+
+def find_cost_matrix(map_rep, locs1, locs2, fast=False, processes=None):
+    """
+    Return the costs of the shortest (or, if fast is True, fastest) paths
+    between many pairs of locations at once.
+
+    Parameters:
+        map_rep: the result of calling build_internal_representation
+        locs1: list of (latitude, longitude) tuples, the start locations
+        locs2: list of (latitude, longitude) tuples, the end locations
+        fast: if True, the costs are travel times (in hours) rather than
+              distances (in miles)
+        processes: number of worker processes to use (by default, one per
+                   CPU)
+
+    Returns:
+        a list with one array.array of floats per start location, where
+        entry j of row i is the cost of the best path from locs1[i] to
+        locs2[j] (inf if there is no such path).  As in find_short_path,
+        every location is first snapped to its nearest node.
+    """
+    sources = [nearest_node(map_rep, loc) for loc in locs1]
+    targets = [nearest_node(map_rep, loc) for loc in locs2]
+    return cost_matrix(map_rep, sources, targets, 'times' if fast else 'lengths', processes)
+
+
+def find_reachable_nodes(map_rep, loc, minutes, stats=None):
+    """
+    Return the nodes that can be reached from the given location within the
+    given number of minutes (driving at the speed limit).
+
+    Parameters:
+        map_rep: the result of calling build_internal_representation
+        loc: tuple of 2 floats: (latitude, longitude), the start location,
+             which is snapped to its nearest node as in find_fast_path
+        minutes: the time budget, in minutes
+        stats: if given, a dictionary in which to count the work done by the
+               search (see routing.py)
+
+    Returns:
+        a dictionary mapping the ID of each reachable node to the number of
+        minutes it takes to get there.  util.to_kml_points and
+        util.to_kml_polygon can draw the result, given the locations of
+        these nodes (see find_reachable_locations).
+    """
+    source = nearest_node(map_rep, loc)
+    if source is None:
+        return {}
+    reached = within_budget(map_rep, source, minutes / 60, 'times', stats)
+    return {map_rep['ids'][i]: hours * 60 for i, hours in reached.items()}
+
+
+def find_reachable_locations(map_rep, loc, minutes):
+    """
+    Like find_reachable_nodes, but return a list of ((latitude, longitude),
+    minutes) tuples, sorted by arrival time.
+    """
+    source = nearest_node(map_rep, loc)
+    if source is None:
+        return []
+    reached = within_budget(map_rep, source, minutes / 60, 'times')
+    return [(node_location(map_rep, i), hours * 60) for i, hours in reached.items()]
 
 
 if __name__ == '__main__':
@@ -0,0 +1,182 @@
+"""
+ALT (A*, landmarks and the triangle inequality) preprocessing for the
+compact graphs built by graph.py.
+
+A handful of landmark nodes are picked far apart from each other, and the
+cost from every landmark L to every node and from every node to L is
+computed ahead of time.  By the triangle inequality, for any nodes v and t,
+    cost(v, t) >= cost(L, t) - cost(L, v)
+    cost(v, t) >= cost(v, L) - cost(t, L)
+and the largest of these bounds over all landmarks is an A* heuristic that is
+usually much tighter than the great-circle distance.
+
+Preprocessing is just two Dijkstra searches per landmark and metric, so it is
+cheap to redo when speeds change.  The tables are stored as flat arrays: for
+landmark k, the cost from it to node v is '<metric>.from'[k * n + v], and the
+cost from v to it is '<metric>.to'[k * n + v] (inf when there is no path).
+"""
+import os
+import heapq
+from array import array
+
+from graph import save_arrays, read_arrays, graph_fingerprint, reverse_adjacency
+
+LANDMARKS_VERSION = 1
+LANDMARK_COUNT = 8
+METRICS = ('lengths', 'times')
+
+INF = float('inf')
+
+
+def landmarks_filename(nodes_filename):
+    """
+    Return the name of the landmark table file for the given .nodes file.
+    """
+    return os.path.splitext(nodes_filename)[0] + '.alt'
+
+
+def _costs(n, offsets, endpoints, edges, weights, source):
+    """
+    Run Dijkstra's algorithm from source over the CSR adjacency given by
+    offsets and endpoints (with edges[j] the index into weights of entry j),
+    and return an array of the cost to reach every node.
+    """
+    costs = array('d', [INF]) * n
+    costs[source] = 0.0
+    agenda = [(0.0, source)]
+    while agenda:
+        cost, node = heapq.heappop(agenda)
+        if cost > costs[node]:
+            continue
+        for j in range(offsets[node], offsets[node + 1]):
+            neighbor = endpoints[j]
+            new_cost = cost + weights[edges[j]]
+            if new_cost < costs[neighbor]:
+                costs[neighbor] = new_cost
+                heapq.heappush(agenda, (new_cost, neighbor))
+    return costs
+
+
+def build_landmarks(graph, count=LANDMARK_COUNT, metrics=METRICS):
+    """
+    Choose up to count landmarks and compute their cost tables for the given
+    metrics.  Returns a dictionary holding the array 'nodes' (the landmarks)
+    and the '<metric>.from' and '<metric>.to' tables.
+
+    Landmarks are picked farthest-first by distance: each one is the node
+    whose distance from the landmarks so far is largest, preferring nodes
+    that none of them can reach at all (so that every part of a disconnected
+    map gets a landmark).
+    """
+    n = len(graph['ids'])
+    forward = (graph['offsets'], graph['targets'], range(len(graph['targets'])))
+    reverse = reverse_adjacency(graph)
+    backward = (reverse['offsets'], reverse['sources'], reverse['edges'])
+    tables = {'nodes': array('i')}
+    for metric in metrics:
+        tables[f'{metric}.from'] = array('d')
+        tables[f'{metric}.to'] = array('d')
+    if n == 0:
+        return tables
+
+    # closest[v] is the distance to v from the nearest landmark so far (inf
+    # if none of them can reach it); the first landmark is the node farthest
+    # from an arbitrary one
+    closest = _costs(n, *forward, graph['lengths'], 0)
+    chosen = set()
+    for i in range(min(count, n)):
+        landmark = max((v for v in range(n) if v not in chosen), key=closest.__getitem__)
+        chosen.add(landmark)
+        tables['nodes'].append(landmark)
+        for metric in metrics:
+            tables[f'{metric}.from'].extend(_costs(n, *forward, graph[metric], landmark))
+            tables[f'{metric}.to'].extend(_costs(n, *backward, graph[metric], landmark))
+        if 'lengths' in metrics:
+            distance = tables['lengths.from'][i * n:]
+        else:
+            distance = _costs(n, *forward, graph['lengths'], landmark)
+        if i == 0:
+            closest = distance
+        else:
+            for v in range(n):
+                if distance[v] < closest[v]:
+                    closest[v] = distance[v]
+    return tables
+
+
+def _layout(metrics):
+    layout = [('nodes', 'i')]
+    for metric in metrics:
+        layout.append((f'{metric}.from', 'd'))
+        layout.append((f'{metric}.to', 'd'))
+    return tuple(layout)
+
+
+def _signature(graph, metrics):
+    return {
+        'version': LANDMARKS_VERSION,
+        'graph': graph_fingerprint(graph),
+        'metrics': metrics,
+    }
+
+
+def prepare_landmarks(graph, filename=None, count=LANDMARK_COUNT, metrics=METRICS):
+    """
+    Attach landmark tables for the given metrics to the graph (as
+    graph['landmarks']), so that routing.find_path uses them.
+
+    If filename is given, the tables are loaded from that file when it
+    matches the graph, and built and saved there otherwise.
+    """
+    metrics = tuple(sorted(metrics))
+    tables = None
+    if filename is not None:
+        tables = read_arrays(filename, _layout(metrics), _signature(graph, metrics))
+        if tables is not None and len(tables['nodes']) != min(count, len(graph['ids'])):
+            tables = None
+    if tables is None:
+        tables = build_landmarks(graph, count, metrics)
+        if filename is not None:
+            try:
+                save_arrays(tables, _layout(metrics), filename, _signature(graph, metrics))
+            except OSError:
+                pass
+    graph['landmarks'] = tables
+    return tables
+
+
+def has_landmarks(graph, metric):
+    """
+    Return whether landmark tables for the metric are attached to the graph.
+    """
+    return f'{metric}.from' in graph.get('landmarks', {})
+
+
+def landmark_heuristic(graph, target, metric):
+    """
+    Return a function giving, for a node index, the best landmark lower bound
+    on the cost of getting from that node to target (inf if the landmarks
+    show that target cannot be reached from it).
+    """
+    tables = graph['landmarks']
+    n = len(graph['ids'])
+    costs_from = tables[f'{metric}.from']
+    costs_to = tables[f'{metric}.to']
+    rows = [k * n for k in range(len(tables['nodes']))]
+    target_from = [costs_from[row + target] for row in rows]
+    target_to = [costs_to[row + target] for row in rows]
+    def heuristic(node):
+        bound = 0.0
+        for row, from_target, to_target in zip(rows, target_from, target_to):
+            from_node = costs_from[row + node]
+            if from_node < INF:
+                # cost(L, t) <= cost(L, v) + cost(v, t)
+                if from_target - from_node > bound:
+                    bound = from_target - from_node
+            to_node = costs_to[row + node]
+            if to_target < INF:
+                # cost(v, L) <= cost(v, t) + cost(t, L)
+                if to_node - to_target > bound:
+                    bound = to_node - to_target
+        return bound
+    return heuristic
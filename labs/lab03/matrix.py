@@ -0,0 +1,83 @@
+"""
+Many-to-many cost matrices over the compact graphs built by graph.py.
+
+Instead of one path query per (source, target) pair, each source gets a
+single one-to-many Dijkstra search, which stops as soon as every target has
+been reached.  Sources are spread over a process pool; the workers receive
+the graph once, when they start (with the 'fork' start method they simply
+share the parent's copy), rather than once per task.
+"""
+import heapq
+import multiprocessing
+from array import array
+
+INF = float('inf')
+
+
+def costs_from(graph, source, targets, metric):
+    """
+    Return an array of the minimum cost, under the given metric, of getting
+    from node source to each node in targets (inf for those that cannot be
+    reached, and for any None, which stands for no node at all).
+    """
+    if source is None:
+        return array('d', [INF]) * len(targets)
+    offsets = graph['offsets']
+    endpoints = graph['targets']
+    weights = graph[metric]
+    remaining = set(targets)
+    best = {source: 0.0}
+    done = set()
+    agenda = [(0.0, source)]
+    while agenda and remaining:
+        cost, node = heapq.heappop(agenda)
+        if node in done:
+            continue
+        done.add(node)
+        remaining.discard(node)
+        for e in range(offsets[node], offsets[node + 1]):
+            neighbor = endpoints[e]
+            new_cost = cost + weights[e]
+            if neighbor not in best or new_cost < best[neighbor]:
+                best[neighbor] = new_cost
+                heapq.heappush(agenda, (new_cost, neighbor))
+    return array('d', (best[t] if t in done else INF for t in targets))
+
+
+# the graph and query shared by the workers of a pool, set by _start_worker
+_shared = None
+
+
+def _start_worker(graph, targets, metric):
+    global _shared
+    _shared = (graph, targets, metric)
+
+
+def _worker_row(source):
+    graph, targets, metric = _shared
+    return costs_from(graph, source, targets, metric)
+
+
+def cost_matrix(graph, sources, targets, metric, processes=None):
+    """
+    Return the matrix of minimum costs from each node in sources to each node
+    in targets (dense indices), under the given metric, as a list with one
+    array of costs per source.
+
+    The rows are computed by a pool of the given number of processes (by
+    default, one per CPU); with processes=1, or a single source, everything
+    runs in this process.
+    """
+    # repeated sources are only searched once
+    unique_sources = list(dict.fromkeys(sources))
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(unique_sources))
+    if processes <= 1:
+        rows = [costs_from(graph, source, targets, metric) for source in unique_sources]
+    else:
+        with multiprocessing.Pool(processes, _start_worker, (graph, targets, metric)) as pool:
+            chunksize = max(1, len(unique_sources) // (4 * processes))
+            rows = pool.map(_worker_row, unique_sources, chunksize)
+    row_of = dict(zip(unique_sources, rows))
+    return [array('d', row_of[source]) for source in sources]
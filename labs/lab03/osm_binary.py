@@ -0,0 +1,314 @@
+"""
+Packed binary versions of the .nodes and .ways files used in 6.009 lab 3.
+
+The serial pickle format stores one pickled dictionary per element, which is
+slow to parse and can only be read from start to end.  The binary format
+stores the same information column by column, so that a reader can
+memory-map the file and look at any element (or any column) without parsing
+the rest:
+
+    nodes file: ids (int64), lat, lon (float64), tag_offsets (int64)
+    ways file:  ids (int64), ref_offsets (int64), refs (int64 node ids),
+                tag_offsets (int64)
+    both:       tag_pairs (int32 key/value indices into the string table),
+                string_offsets (int64), string_kinds (int8), string_data
+
+The tags of element i are the pairs tag_pairs[2*j], tag_pairs[2*j+1] for j
+from tag_offsets[i] to tag_offsets[i+1]-1, and the nodes of way i are
+refs[ref_offsets[i]:ref_offsets[i+1]].  Each distinct tag key or value is
+stored once in the string table, as UTF-8 text; string_kinds marks the
+values (such as maxspeed_mph) that were integers rather than strings.
+
+A file starts with MAGIC, then the length of a JSON header and the header
+itself, which gives the element kind and the typecode, offset and length of
+every section.  Sections start on 8-byte boundaries.
+
+Example usage:
+    with open_binary('resources/cambridge.ways') as data:
+        for way in data:
+            print(way['id'], way['tags'].get('highway'))
+"""
+import os
+import sys
+import json
+import mmap
+import struct
+from array import array
+
+MAGIC = b'6009OSM\x01'
+ALIGNMENT = 8
+
+# columns of each kind of file, in the order they are stored
+COLUMNS = {
+    'nodes': (('ids', 'q'), ('lat', 'd'), ('lon', 'd'), ('tag_offsets', 'q')),
+    'ways': (('ids', 'q'), ('ref_offsets', 'q'), ('refs', 'q'), ('tag_offsets', 'q')),
+}
+STRING_COLUMNS = (
+    ('tag_pairs', 'i'), ('string_offsets', 'q'), ('string_kinds', 'b'), ('string_data', 'B'),
+)
+
+STRING, INTEGER = 0, 1
+
+# columns are buffered in memory up to this many entries before being
+# written out to their spill files
+FLUSH_SIZE = 1 << 16
+
+
+def is_binary(filename):
+    """
+    Return whether the given file is in the binary format (rather than being
+    a serial pickle file).
+    """
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class BinaryWriter:
+    """
+    Writes nodes or ways (given as the same dictionaries that would be
+    pickled into a .nodes or .ways file) to a file in the binary format.
+
+    Columns are spilled to temporary files as they grow, so memory use only
+    depends on the number of distinct tag strings, not on the size of the
+    extract.  The output file is put together when the writer is closed.
+    """
+
+    def __init__(self, filename, kind):
+        self.filename = filename
+        self.kind = kind
+        self.columns = COLUMNS[kind] + (('tag_pairs', 'i'),)
+        self.buffers = {name: array(typecode) for name, typecode in self.columns}
+        self.counts = {name: 0 for name, _ in self.columns}
+        self.spills = {
+            name: open(f'{filename}.{name}.{os.getpid()}.tmp', 'w+b')
+            for name, _ in self.columns
+        }
+        self.strings = {}
+        self.buffers['tag_offsets'].append(0)
+        if kind == 'ways':
+            self.buffers['ref_offsets'].append(0)
+        self.tag_count = 0
+        self.ref_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None:
+            self.close()
+        else:
+            self.discard()
+
+    def _intern(self, value):
+        key = (type(value) is int, value)
+        if key not in self.strings:
+            self.strings[key] = len(self.strings)
+        return self.strings[key]
+
+    def _append(self, name, value):
+        buffer = self.buffers[name]
+        buffer.append(value)
+        if len(buffer) >= FLUSH_SIZE:
+            self._flush(name)
+
+    def _flush(self, name):
+        buffer = self.buffers[name]
+        if sys.byteorder != 'little':
+            buffer.byteswap()
+        buffer.tofile(self.spills[name])
+        self.counts[name] += len(buffer)
+        del buffer[:]
+
+    def write(self, element):
+        """
+        Add one node or way to the file.
+        """
+        self._append('ids', element['id'])
+        if self.kind == 'nodes':
+            self._append('lat', element['lat'])
+            self._append('lon', element['lon'])
+        else:
+            for ref in element['nodes']:
+                self._append('refs', ref)
+            self.ref_count += len(element['nodes'])
+            self._append('ref_offsets', self.ref_count)
+        for key, value in element['tags'].items():
+            self._append('tag_pairs', self._intern(key))
+            self._append('tag_pairs', self._intern(value))
+        self.tag_count += len(element['tags'])
+        self._append('tag_offsets', self.tag_count)
+
+    def _string_table(self):
+        offsets = array('q', [0])
+        kinds = array('b')
+        data = bytearray()
+        for is_int, value in self.strings:
+            data += str(value).encode('utf-8')
+            offsets.append(len(data))
+            kinds.append(INTEGER if is_int else STRING)
+        return {
+            'string_offsets': offsets,
+            'string_kinds': kinds,
+            'string_data': array('B', data),
+        }
+
+    def close(self):
+        """
+        Write the output file and remove the spill files.
+        """
+        for name, _ in self.columns:
+            self._flush(name)
+        table = self._string_table()
+        sections = {}
+        position = 0
+        layout = self.columns + STRING_COLUMNS[1:]
+        for name, typecode in layout:
+            length = self.counts[name] if name in self.counts else len(table[name])
+            sections[name] = (typecode, position, length)
+            size = length * array(typecode).itemsize
+            position += -(-size // ALIGNMENT) * ALIGNMENT
+        header = json.dumps({'kind': self.kind, 'sections': sections}).encode('utf-8')
+        start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+        temp_filename = f'{self.filename}.{os.getpid()}.tmp'
+        with open(temp_filename, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<q', len(header)))
+            f.write(header)
+            for name, typecode in layout:
+                f.seek(start + sections[name][1])
+                if name in self.spills:
+                    spill = self.spills[name]
+                    spill.seek(0)
+                    while True:
+                        chunk = spill.read(1 << 20)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                else:
+                    column = table[name]
+                    if sys.byteorder != 'little':
+                        column.byteswap()
+                    column.tofile(f)
+            f.truncate(start + position)
+        os.replace(temp_filename, self.filename)
+        self.discard()
+
+    def discard(self):
+        """
+        Remove the spill files without writing the output file.
+        """
+        for spill in self.spills.values():
+            spill.close()
+            os.remove(spill.name)
+        self.spills = {}
+
+
+class BinaryData:
+    """
+    A memory-mapped file in the binary format.
+
+    Every section is available as a zero-copy memoryview in self.columns
+    (e.g. self.columns['lat']), and iterating over the object yields the
+    same dictionaries read_osm_data yields for a serial pickle file.
+    """
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{filename} is not a binary OSM file')
+            header_size, = struct.unpack('<q', f.read(8))
+            header = json.loads(f.read(header_size))
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if sys.byteorder != 'little':
+            raise ValueError('binary OSM files can only be mapped on little-endian machines')
+        self.kind = header['kind']
+        start = -(-(len(MAGIC) + 8 + header_size) // ALIGNMENT) * ALIGNMENT
+        view = memoryview(self.map)
+        self.columns = {}
+        for name, (typecode, offset, length) in header['sections'].items():
+            size = length * array(typecode).itemsize
+            self.columns[name] = view[start + offset:start + offset + size].cast(typecode)
+        view.release()
+        self._strings = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Release the column views and unmap the file.  Views obtained from the
+        object must not be used afterwards.
+        """
+        for column in self.columns.values():
+            column.release()
+        self.columns = {}
+        self.map.close()
+
+    def __len__(self):
+        return len(self.columns['ids'])
+
+    def string(self, index):
+        """
+        Return entry index of the string table (an int for integer values).
+        """
+        if index not in self._strings:
+            offsets = self.columns['string_offsets']
+            text = bytes(self.columns['string_data'][offsets[index]:offsets[index + 1]]).decode('utf-8')
+            self._strings[index] = int(text) if self.columns['string_kinds'][index] == INTEGER else text
+        return self._strings[index]
+
+    def tags(self, i):
+        """
+        Return the tags of element i, as a dictionary.
+        """
+        offsets, pairs = self.columns['tag_offsets'], self.columns['tag_pairs']
+        return {
+            self.string(pairs[2 * j]): self.string(pairs[2 * j + 1])
+            for j in range(offsets[i], offsets[i + 1])
+        }
+
+    def refs(self, i):
+        """
+        Return the node ids of way i, as a zero-copy view.
+        """
+        offsets = self.columns['ref_offsets']
+        return self.columns['refs'][offsets[i]:offsets[i + 1]]
+
+    def element(self, i):
+        """
+        Return element i as a dictionary, in the same form as the serial
+        pickle format.
+        """
+        columns = self.columns
+        if self.kind == 'nodes':
+            return {'id': columns['ids'][i], 'lat': columns['lat'][i],
+                    'lon': columns['lon'][i], 'tags': self.tags(i)}
+        return {'id': columns['ids'][i], 'nodes': self.refs(i).tolist(), 'tags': self.tags(i)}
+
+    def __iter__(self):
+        columns = self.columns
+        ids, tag_offsets = columns['ids'], columns['tag_offsets']
+        if self.kind == 'nodes':
+            lat, lon = columns['lat'], columns['lon']
+            for i in range(len(self)):
+                tags = self.tags(i) if tag_offsets[i] != tag_offsets[i + 1] else {}
+                yield {'id': ids[i], 'lat': lat[i], 'lon': lon[i], 'tags': tags}
+        else:
+            refs, ref_offsets = columns['refs'], columns['ref_offsets']
+            for i in range(len(self)):
+                nodes = refs[ref_offsets[i]:ref_offsets[i + 1]].tolist()
+                yield {'id': ids[i], 'nodes': nodes, 'tags': self.tags(i)}
+
+
+def open_binary(filename):
+    """
+    Memory-map the given binary OSM file, returning a BinaryData object.
+    """
+    return BinaryData(filename)
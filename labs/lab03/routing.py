@@ -0,0 +1,263 @@
+"""
+Shortest-path searches over the compact graphs built by graph.py.
+
+Searches work on dense node indices, and minimize one of the graph's per-edge
+weight arrays, named by metric: 'lengths' for the shortest path by distance,
+or 'times' for the fastest path.
+
+If stats is a dictionary, a search records what it did in it:
+    popped: number of nodes taken off the agenda and expanded
+    relaxed: number of edges that improved the best known cost of a node
+"""
+import heapq
+
+import hierarchy
+import landmarks
+from graph import reverse_adjacency
+from util import great_circle_distance
+
+INF = float('inf')
+
+
+def max_speed(graph):
+    """
+    Return the highest speed limit (in miles per hour) of any edge in the
+    graph, i.e. the highest of the default speeds and maxspeed_mph tags that
+    are actually in use.
+    """
+    if 'max_speed' not in graph:
+        graph['max_speed'] = max(graph['speeds'], default=0.0)
+    return graph['max_speed']
+
+
+def distance_heuristic(graph, target, metric):
+    """
+    Return a function giving, for a node index, a lower bound on the cost of
+    getting from that node to target under the given metric.
+
+    No path is shorter than the great-circle distance between its ends, and
+    no path is faster than that distance covered at the graph's top speed.
+    """
+    lat, lon = graph['lat'], graph['lon']
+    goal = (lat[target], lon[target])
+    scale = 1.0
+    if metric == 'times':
+        speed = max_speed(graph)
+        scale = 1.0 / speed if speed else 0.0
+    def heuristic(node):
+        return great_circle_distance((lat[node], lon[node]), goal) * scale
+    return heuristic
+
+
+def _path_to(parent, node):
+    path = []
+    while node is not None:
+        path.append(node)
+        node = parent[node]
+    return path[::-1]
+
+
+def _count(stats, popped, relaxed):
+    if stats is not None:
+        stats['popped'] = stats.get('popped', 0) + popped
+        stats['relaxed'] = stats.get('relaxed', 0) + relaxed
+
+
+def astar(graph, source, target, metric, stats=None, heuristic=None):
+    """
+    Find a minimum-cost path from node source to node target with A* search,
+    guided by heuristic (by default, distance_heuristic).
+
+    Returns the list of node indices along the path, or None if target cannot
+    be reached from source.
+    """
+    if heuristic is None:
+        heuristic = distance_heuristic(graph, target, metric)
+    offsets = graph['offsets']
+    targets = graph['targets']
+    weights = graph[metric]
+    best = {source: 0.0}
+    parent = {source: None}
+    done = set()
+    agenda = [(heuristic(source), source)]
+    popped = relaxed = 0
+    while agenda:
+        _, node = heapq.heappop(agenda)
+        if node in done:
+            continue
+        popped += 1
+        if node == target:
+            _count(stats, popped, relaxed)
+            return _path_to(parent, node)
+        done.add(node)
+        cost = best[node]
+        for e in range(offsets[node], offsets[node + 1]):
+            neighbor = targets[e]
+            new_cost = cost + weights[e]
+            if neighbor not in best or new_cost < best[neighbor]:
+                best[neighbor] = new_cost
+                parent[neighbor] = node
+                relaxed += 1
+                estimate = new_cost + heuristic(neighbor)
+                # an infinite estimate means target cannot be reached from there
+                if estimate < INF:
+                    heapq.heappush(agenda, (estimate, neighbor))
+    _count(stats, popped, relaxed)
+    return None
+
+
+def dijkstra(graph, source, target, metric, stats=None):
+    """
+    Find a minimum-cost path from node source to node target with Dijkstra's
+    algorithm (A* without a heuristic).
+    """
+    return astar(graph, source, target, metric, stats, lambda node: 0.0)
+
+
+def bidirectional(graph, source, target, metric, stats=None):
+    """
+    Find a minimum-cost path from node source to node target with
+    bidirectional Dijkstra: a forward search from source over the outgoing
+    edges and a backward search from target over the incoming edges (see
+    graph.reverse_adjacency), always advancing the one with the cheaper next
+    node.
+
+    Whenever an edge joins the two searches, the path through it is a
+    candidate.  Once the next costs of the two searches add up to at least
+    the cheapest candidate, no undiscovered path can be cheaper, so the
+    search stops.
+    """
+    if source == target:
+        _count(stats, 1, 0)
+        return [source]
+    reverse = reverse_adjacency(graph)
+    weights = graph[metric]
+    sides = (
+        (graph['offsets'], graph['targets'], None),
+        (reverse['offsets'], reverse['sources'], reverse['edges']),
+    )
+    best = ({source: 0.0}, {target: 0.0})
+    parent = ({source: None}, {target: None})
+    done = (set(), set())
+    agendas = ([(0.0, source)], [(0.0, target)])
+    meeting, meeting_cost = None, INF
+    popped = relaxed = 0
+    while agendas[0] and agendas[1]:
+        if agendas[0][0][0] + agendas[1][0][0] >= meeting_cost:
+            break
+        side = 0 if agendas[0][0][0] <= agendas[1][0][0] else 1
+        cost, node = heapq.heappop(agendas[side])
+        if node in done[side]:
+            continue
+        done[side].add(node)
+        popped += 1
+        offsets, endpoints, edges = sides[side]
+        other = best[1 - side]
+        for j in range(offsets[node], offsets[node + 1]):
+            neighbor = endpoints[j]
+            new_cost = cost + weights[j if edges is None else edges[j]]
+            if neighbor not in best[side] or new_cost < best[side][neighbor]:
+                best[side][neighbor] = new_cost
+                parent[side][neighbor] = node
+                relaxed += 1
+                heapq.heappush(agendas[side], (new_cost, neighbor))
+            if neighbor in other and best[side][neighbor] + other[neighbor] < meeting_cost:
+                meeting = neighbor
+                meeting_cost = best[side][neighbor] + other[neighbor]
+    _count(stats, popped, relaxed)
+    if meeting is None:
+        return None
+    path = _path_to(parent[0], meeting)
+    node = parent[1][meeting]
+    while node is not None:
+        path.append(node)
+        node = parent[1][node]
+    return path
+
+
+def alt(graph, source, target, metric, stats=None):
+    """
+    Find a minimum-cost path from node source to node target with A* search
+    guided by the graph's landmark tables for the metric (see landmarks.py),
+    falling back on distance_heuristic where it happens to be tighter.
+    """
+    from_landmarks = landmarks.landmark_heuristic(graph, target, metric)
+    from_distance = distance_heuristic(graph, target, metric)
+    def heuristic(node):
+        return max(from_landmarks(node), from_distance(node))
+    return astar(graph, source, target, metric, stats, heuristic)
+
+
+# search methods that can be chosen by name in find_path
+methods = {
+    'dijkstra': dijkstra,
+    'astar': astar,
+    'bidirectional': bidirectional,
+    'alt': alt,
+    'ch': hierarchy.query,
+}
+
+# search method to use for each metric when nothing has been preprocessed: the
+# great-circle bound guides A* well for distances, but at the top speed it is
+# too loose for times, where bidirectional Dijkstra does less work
+DEFAULT_METHODS = {'lengths': 'astar', 'times': 'bidirectional'}
+
+
+def default_method(graph, metric):
+    """
+    Return the name of the fastest search method available for the metric:
+    the contraction hierarchy if one has been prepared, then the landmark
+    tables if those have, and otherwise DEFAULT_METHODS[metric].
+    """
+    if metric in graph.get('hierarchies', {}):
+        return 'ch'
+    if landmarks.has_landmarks(graph, metric):
+        return 'alt'
+    return DEFAULT_METHODS.get(metric, 'bidirectional')
+
+
+def find_path(graph, source, target, metric, stats=None, method=None):
+    """
+    Find a minimum-cost path from node source to node target under the given
+    metric, with the named search method (by default, see default_method).
+
+    Returns the list of node indices along the path, or None if target cannot
+    be reached from source.  Raises ValueError for an unknown method.
+    """
+    if method is None:
+        method = default_method(graph, metric)
+    if method not in methods:
+        raise ValueError(f'unknown search method: {method!r}')
+    return methods[method](graph, source, target, metric, stats)
+
+
+def within_budget(graph, source, budget, metric, stats=None):
+    """
+    Find every node that can be reached from node source at a cost of at most
+    budget under the given metric, with a Dijkstra search that stops as soon
+    as the next node on the agenda is over budget.
+
+    Returns a dictionary mapping each reachable node index to its cost.
+    """
+    offsets = graph['offsets']
+    targets = graph['targets']
+    weights = graph[metric]
+    best = {source: 0.0}
+    reached = {}
+    agenda = [(0.0, source)]
+    popped = relaxed = 0
+    while agenda and agenda[0][0] <= budget:
+        cost, node = heapq.heappop(agenda)
+        if node in reached:
+            continue
+        reached[node] = cost
+        popped += 1
+        for e in range(offsets[node], offsets[node + 1]):
+            neighbor = targets[e]
+            new_cost = cost + weights[e]
+            if new_cost <= budget and (neighbor not in best or new_cost < best[neighbor]):
+                best[neighbor] = new_cost
+                relaxed += 1
+                heapq.heappush(agenda, (new_cost, neighbor))
+    _count(stats, popped, relaxed)
+    return reached
@@ -3,13 +3,19 @@ import sys
 import json
 import time
 import pickle
+import threading
 import mimetypes
+import collections
+import socketserver
 
 from wsgiref.handlers import read_environ
-from wsgiref.simple_server import make_server
+from wsgiref.simple_server import make_server, WSGIServer
 
-from util import to_kml, read_osm_data
-from lab import find_short_path, find_fast_path, build_internal_representation
+from util import to_kml, read_osm_data, percentile
+from lab import build_internal_representation, update_way_speeds
+from graph import nearest_node, node_location, reverse_adjacency
+from routing import find_path, max_speed
+from traffic import edge_ways
 
 try:
     dataset = sys.argv[1]
@@ -42,8 +48,29 @@ except:
 print('building internal representation...')
 t = time.time()
 MAP = build_internal_representation(nodes_filename, ways_filename)
+# built lazily otherwise; do it now, before requests share the graph
+reverse_adjacency(MAP)
+max_speed(MAP)
+edge_ways(MAP)
 print('internal representation built in %.02f seconds.' % (time.time() - t,))
 
+# finished /route responses, keyed by (start node, end node, route type,
+# revision), in least- to most-recently used order.  fast routes are keyed by
+# the graph revision they were found under, so that responses from before a
+# /speeds update are not reused afterwards
+ROUTE_CACHE_SIZE = 4096
+ROUTE_CACHE = collections.OrderedDict()
+# how many recent /route requests the latency percentiles are computed over
+LATENCY_WINDOW = 10000
+ROUTE_STATS = {
+    'hits': 0,
+    'misses': 0,
+    'latencies': collections.deque(maxlen=LATENCY_WINDOW),
+}
+ROUTE_LOCK = threading.Lock()
+# /speeds updates are applied one at a time
+SPEEDS_LOCK = threading.Lock()
+
 with open(os.path.join(app_root, 'index.html'), 'rb') as f:
     index_contents = f.read() % center_point
 
@@ -58,20 +85,112 @@ def parse_post(environ):
     return json.loads(body)
 
 
+def route(params):
+    """
+    Return the body of the response to a /route request.  Both endpoints are
+    snapped to their nearest nodes, and the response for that pair of nodes
+    and route type is reused if it is in the cache.
+    """
+    # one graph for the whole request, even if /speeds swaps in a new one
+    graph = MAP
+    kind = 'fast' if params.get('type', None) == 'fast' else 'short'
+    loc1 = float(params['startLat']), float(params['startLon'])
+    loc2 = float(params['endLat']), float(params['endLon'])
+    revision = graph.get('revision', 0) if kind == 'fast' else 0
+    key = (nearest_node(graph, loc1), nearest_node(graph, loc2), kind, revision)
+    with ROUTE_LOCK:
+        body = ROUTE_CACHE.get(key)
+        if body is not None:
+            ROUTE_CACHE.move_to_end(key)
+            ROUTE_STATS['hits'] += 1
+            return body
+        ROUTE_STATS['misses'] += 1
+
+    path = None
+    if key[0] is not None and key[1] is not None:
+        path = find_path(graph, key[0], key[1], 'times' if kind == 'fast' else 'lengths')
+    if path is None:
+        out = {'ok': False, 'error': 'No path found.'}
+    else:
+        out = {'ok': True, 'kml': to_kml([node_location(graph, i) for i in path])}
+    body = json.dumps(out).encode('utf-8')
+    with ROUTE_LOCK:
+        ROUTE_CACHE[key] = body
+        ROUTE_CACHE.move_to_end(key)
+        while len(ROUTE_CACHE) > ROUTE_CACHE_SIZE:
+            ROUTE_CACHE.popitem(last=False)
+    return body
+
+
+def speeds(params):
+    """
+    Return the body of the response to a /speeds request, which sets the
+    speeds of the ways given in params['speeds'] (a mapping from way ids to
+    miles per hour, or to null to restore a way's speed limit).
+
+    The update is applied to a copy of the graph, which then replaces MAP, so
+    routes already being computed keep using the old speeds throughout.
+    """
+    global MAP
+    try:
+        new_speeds = {
+            int(way_id): None if speed is None else float(speed)
+            for way_id, speed in params['speeds'].items()
+        }
+        with SPEEDS_LOCK:
+            graph = dict(MAP)
+            changed = update_way_speeds(graph, new_speeds)
+            MAP = graph
+    except (KeyError, AttributeError, TypeError, ValueError) as e:
+        out = {'ok': False, 'error': str(e)}
+    else:
+        out = {'ok': True, 'changed_edges': changed, 'revision': graph.get('revision', 0)}
+    return json.dumps(out).encode('utf-8')
+
+
+def route_stats():
+    """
+    Return the body of the response to a /stats request: route cache hits and
+    misses, and percentiles of the latency of recent /route requests (in
+    milliseconds).
+    """
+    with ROUTE_LOCK:
+        hits, misses = ROUTE_STATS['hits'], ROUTE_STATS['misses']
+        latencies = sorted(ROUTE_STATS['latencies'])
+        cached = len(ROUTE_CACHE)
+    out = {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / (hits + misses) if hits + misses else None,
+        'cached_routes': cached,
+        'latency_ms': {
+            'count': len(latencies),
+            'p50': percentile(latencies, 0.5),
+            'p90': percentile(latencies, 0.9),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else None,
+        },
+    }
+    return json.dumps(out).encode('utf-8')
+
+
 def application(environ, start_response):
     path = environ.get('PATH_INFO', '/') or '/'
 
     if path == '/route':
-        params = parse_post(environ)
-        func = find_short_path if params.get('type', None) != 'fast' else find_fast_path
-        loc1 = float(params['startLat']), float(params['startLon'])
-        loc2 = float(params['endLat']), float(params['endLon'])
-        route = func(MAP, loc1, loc2)
-        if route is None:
-            out = {'ok': False, 'error': 'No path found.'}
-        else:
-            out = {'ok': True, 'kml': to_kml(route)}
-        body = json.dumps(out).encode('utf-8')
+        start = time.perf_counter()
+        body = route(parse_post(environ))
+        latency = (time.perf_counter() - start) * 1000
+        with ROUTE_LOCK:
+            ROUTE_STATS['latencies'].append(latency)
+        type_ = 'application/json'
+        status = '200 OK'
+    elif path == '/speeds':
+        body = speeds(parse_post(environ))
+        type_ = 'application/json'
+        status = '200 OK'
+    elif path == '/stats':
+        body = route_stats()
         type_ = 'application/json'
         status = '200 OK'
     else:
@@ -104,9 +223,18 @@ def application(environ, start_response):
     return [body]
 
 
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    """
+    WSGI server handling each request in its own thread, so that one slow
+    route does not hold up other users.  Requests share the graph, which is
+    only read; /speeds swaps in an updated copy instead of changing it.
+    """
+    daemon_threads = True
+
+
 if __name__ == '__main__':
     print('starting server.  navigate to http://localhost:6009/')
-    with make_server('', 6009, application) as httpd:
+    with make_server('', 6009, application, server_class=ThreadingWSGIServer) as httpd:
         try:
             httpd.serve_forever()
         except KeyboardInterrupt:
@@ -0,0 +1,146 @@
+"""
+Spatial index for snapping locations to the nodes of a graph from graph.py.
+
+The index is a uniform grid over latitude and longitude, with cells about as
+wide (in miles) as they are tall, and about two nodes per cell on average.  It
+is stored CSR-style like the graph itself: the nodes in cell c are
+cell_nodes[cell_offsets[c]] to cell_nodes[cell_offsets[c+1]-1].
+
+Queries visit the cells in rings of growing size around the query location,
+and stop once no node in an unvisited cell could be closer than the answer
+found so far, so their results are exactly those of a linear scan with
+great_circle_distance (ties go to the lower node index).
+"""
+import heapq
+from array import array
+from math import asin, cos, floor, pi, sin, sqrt
+
+from util import great_circle_distance
+
+EARTH_RADIUS_MILES = 3958
+NODES_PER_CELL = 2
+
+
+def build_grid(lat, lon):
+    """
+    Build the grid index over the nodes with the given coordinates (arrays of
+    latitudes and longitudes, in degrees, indexed by node).
+    """
+    n = len(lat)
+    if n == 0:
+        return None
+    min_lat, max_lat = min(lat), max(lat)
+    min_lon, max_lon = min(lon), max(lon)
+    # cells are h degrees tall and w degrees wide, so that they are roughly
+    # square at the middle latitude of the grid
+    scale = max(cos((min_lat + max_lat) / 2 * pi / 180), 1e-6)
+    lat_span = max_lat - min_lat
+    lon_span = (max_lon - min_lon) * scale
+    cells = max(1, n // NODES_PER_CELL)
+    # never more than cells rows or columns, even when the nodes lie on a line
+    h = max(sqrt(lat_span * lon_span / cells), lat_span / cells, lon_span / cells)
+    if h == 0:
+        h = 1.0
+    w = h / scale
+    rows = int((max_lat - min_lat) / h) + 1
+    cols = int((max_lon - min_lon) / w) + 1
+
+    cells = array('q', (
+        int((lat[i] - min_lat) / h) * cols + int((lon[i] - min_lon) / w)
+        for i in range(n)
+    ))
+    cell_offsets = array('q', bytes(8 * (rows * cols + 1)))
+    for cell in cells:
+        cell_offsets[cell + 1] += 1
+    for c in range(rows * cols):
+        cell_offsets[c + 1] += cell_offsets[c]
+    # a stable sort keeps the nodes of each cell in index order
+    cell_nodes = array('i', sorted(range(n), key=cells.__getitem__))
+
+    # the smallest cosine of any latitude in the grid, for distance bounds
+    min_cos = min(cos(min_lat * pi / 180), cos(max_lat * pi / 180))
+    return {
+        'min_lat': min_lat,
+        'min_lon': min_lon,
+        'height': h,
+        'width': w,
+        'rows': rows,
+        'cols': cols,
+        'min_cos': max(min_cos, 0.0),
+        'cell_offsets': cell_offsets,
+        'cell_nodes': cell_nodes,
+    }
+
+
+def _lower_bound(grid, loc, ring):
+    """
+    Return a distance (in miles) that no node outside the first ring+1 rings
+    of cells around loc can be closer than.
+    """
+    lat_gap = ring * grid['height'] * pi / 180
+    lon_gap = min(ring * grid['width'] * pi / 180, pi)
+    # by the haversine formula, hav(d) >= cos(lat1) cos(lat2) hav(lon gap)
+    c = max(cos(loc[0] * pi / 180), 0.0) * grid['min_cos']
+    lon_bound = 2 * asin(min(1.0, sqrt(c) * sin(lon_gap / 2)))
+    return EARTH_RADIUS_MILES * min(lat_gap, lon_bound)
+
+
+def _rings(grid, loc):
+    """
+    Yield (ring number, node indices in that ring of cells) for the rings of
+    cells around the cell containing loc, until the whole grid is covered.
+    """
+    rows, cols = grid['rows'], grid['cols']
+    offsets, nodes = grid['cell_offsets'], grid['cell_nodes']
+    r0 = floor((loc[0] - grid['min_lat']) / grid['height'])
+    c0 = floor((loc[1] - grid['min_lon']) / grid['width'])
+    # rings that lie entirely outside the grid have no nodes in them
+    first = max(0, -r0, r0 - rows + 1, -c0, c0 - cols + 1)
+    last = max(r0, rows - 1 - r0, c0, cols - 1 - c0)
+    for ring in range(first, last + 1):
+        found = []
+        for r in range(max(r0 - ring, 0), min(r0 + ring, rows - 1) + 1):
+            if r in (r0 - ring, r0 + ring):
+                columns = range(max(c0 - ring, 0), min(c0 + ring, cols - 1) + 1)
+            else:
+                columns = [c for c in (c0 - ring, c0 + ring) if 0 <= c < cols]
+            for c in columns:
+                cell = r * cols + c
+                found.extend(nodes[offsets[cell]:offsets[cell + 1]])
+        yield ring, found
+
+
+def nearest_nodes(grid, lat, lon, loc, k=1):
+    """
+    Return the indices of the k nodes nearest to loc (fewer if there are not
+    that many nodes), closest first.
+    """
+    if grid is None or k <= 0:
+        return []
+    candidates = []
+    for ring, found in _rings(grid, loc):
+        for i in found:
+            candidates.append((great_circle_distance(loc, (lat[i], lon[i])), i))
+        if len(candidates) >= k:
+            best = heapq.nsmallest(k, candidates)
+            if best[-1][0] <= _lower_bound(grid, loc, ring):
+                return [i for _, i in best]
+            candidates = best
+    return [i for _, i in sorted(candidates)]
+
+
+def nodes_within(grid, lat, lon, loc, radius):
+    """
+    Return the indices of all nodes within radius miles of loc, closest first.
+    """
+    if grid is None or radius < 0:
+        return []
+    candidates = []
+    for ring, found in _rings(grid, loc):
+        for i in found:
+            distance = great_circle_distance(loc, (lat[i], lon[i]))
+            if distance <= radius:
+                candidates.append((distance, i))
+        if _lower_bound(grid, loc, ring) > radius:
+            break
+    return [i for _, i in sorted(candidates)]
@@ -272,6 +272,420 @@ def test_cambridge_fast(testcase):
     compare_output('cambridge', inps, ix, 'fast')
 
 
+def make_grid_map(directory, size=12, seed=6009):
+    """
+    Write a synthetic size-by-size street grid (with some one-way streets and
+    speed limits) to .nodes and .ways files in the given directory, and
+    return their names.
+    """
+    import random
+    rng = random.Random(seed)
+    nodes_name = os.path.join(directory, 'grid.nodes')
+    ways_name = os.path.join(directory, 'grid.ways')
+    def node_id(r, c):
+        return 1000 + r * size + c
+    with open(nodes_name, 'wb') as f:
+        for r in range(size):
+            for c in range(size):
+                pickle.dump({'id': node_id(r, c), 'tags': {},
+                             'lat': 42.35 + 0.001 * r + 0.0003 * rng.random(),
+                             'lon': -71.1 + 0.001 * c + 0.0003 * rng.random()}, f)
+    with open(ways_name, 'wb') as f:
+        way_id = 0
+        for line in range(size):
+            for nodes in ([node_id(line, c) for c in range(size)],
+                          [node_id(r, line) for r in range(size)]):
+                # split each street into blocks with their own tags
+                for start in range(0, size - 1, 3):
+                    tags = {'highway': rng.choice(['residential', 'primary', 'secondary', 'footway'])}
+                    if rng.random() < 0.25:
+                        tags['oneway'] = 'yes'
+                    if rng.random() < 0.25:
+                        tags['maxspeed_mph'] = rng.choice([15, 40, 65])
+                    pickle.dump({'id': way_id, 'nodes': nodes[start:start + 4], 'tags': tags}, f)
+                    way_id += 1
+    return nodes_name, ways_name
+
+
+def path_cost(map_rep, path, metric):
+    import graph
+    cost = 0
+    for a, b in zip(path, path[1:]):
+        i, j = graph.node_index(map_rep, a), graph.node_index(map_rep, b)
+        cost += min(map_rep[metric][e]
+                    for e in range(map_rep['offsets'][i], map_rep['offsets'][i + 1])
+                    if map_rep['targets'][e] == j)
+    return cost
+
+
+def test_search_methods(tmp_path):
+    # every search method should find paths of the same cost, and each one
+    # should expand fewer nodes than plain Dijkstra's algorithm
+    import random
+    import routing
+    import hierarchy
+    import landmarks
+    map_rep = lab.build_internal_representation(*make_grid_map(tmp_path))
+    assert routing.default_method(map_rep, 'lengths') == 'astar'
+    assert routing.default_method(map_rep, 'times') == 'bidirectional'
+    hierarchy_name = os.path.join(tmp_path, 'grid.ch')
+    built = hierarchy.prepare_hierarchies(map_rep, hierarchy_name)
+    assert hierarchy.read_hierarchies(map_rep, hierarchy_name) == built
+    landmarks_name = os.path.join(tmp_path, 'grid.alt')
+    built = landmarks.prepare_landmarks(map_rep, landmarks_name)
+    assert landmarks.prepare_landmarks(map_rep, landmarks_name) == built
+    rng = random.Random(6009)
+    ids = list(map_rep['ids'])
+    popped = {method: 0 for method in routing.methods}
+    for _ in range(50):
+        node1, node2 = rng.choice(ids), rng.choice(ids)
+        for metric in ('lengths', 'times'):
+            costs = set()
+            for method in routing.methods:
+                stats = {}
+                path = routing.find_path(
+                    map_rep, ids.index(node1), ids.index(node2), metric, stats, method
+                )
+                popped[method] += stats['popped']
+                if path is None:
+                    costs.add(None)
+                else:
+                    path = [ids[i] for i in path]
+                    assert path[0] == node1 and path[-1] == node2
+                    costs.add(round(path_cost(map_rep, path, metric), 9))
+            assert len(costs) == 1
+    assert popped['astar'] < popped['dijkstra']
+    assert popped['bidirectional'] < popped['dijkstra']
+    assert popped['alt'] < popped['astar']
+    assert popped['ch'] < popped['astar']
+    with pytest.raises(ValueError):
+        routing.find_path(map_rep, 0, 1, 'lengths', method='bogus')
+
+
+def test_cost_matrix(tmp_path):
+    # each entry should be the cost of the path find_path would return, for
+    # both metrics, whether or not the rows are computed in worker processes
+    import random
+    import graph
+    import routing
+    map_rep = lab.build_internal_representation(*make_grid_map(tmp_path))
+    rng = random.Random(6009)
+    locs = [(42.35 + 0.012 * rng.random(), -71.1 + 0.012 * rng.random()) for _ in range(12)]
+    for fast, metric in ((False, 'lengths'), (True, 'times')):
+        matrix = lab.find_cost_matrix(map_rep, locs[:5], locs[5:], fast, processes=1)
+        assert lab.find_cost_matrix(map_rep, locs[:5], locs[5:], fast, processes=2) == matrix
+        for i, loc1 in enumerate(locs[:5]):
+            for j, loc2 in enumerate(locs[5:]):
+                path = routing.find_path(
+                    map_rep, graph.nearest_node(map_rep, loc1),
+                    graph.nearest_node(map_rep, loc2), metric,
+                )
+                if path is None:
+                    assert matrix[i][j] == float('inf')
+                else:
+                    expected = path_cost(map_rep, [map_rep['ids'][k] for k in path], metric)
+                    assert abs(matrix[i][j] - expected) <= 1e-9
+
+
+SMALL_OSM = '''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+ <bounds minlat="42.3500" minlon="-71.1100" maxlat="42.3700" maxlon="-71.0900"/>
+ <node id="1" lat="42.3601" lon="-71.0952"/>
+ <node id="2" lat="42.3592" lon="-71.0932">
+  <tag k="name" v="Lobby 7 – Massachusetts Ave"/>
+ </node>
+ <node id="3" lat="42.3582" lon="-71.0931"/>
+ <node id="4" lat="42.3575" lon="-71.0927"/>
+ <way id="10">
+  <nd ref="1"/>
+  <nd ref="2"/>
+  <nd ref="3"/>
+  <tag k="highway" v="primary"/>
+  <tag k="maxspeed" v="30 mph"/>
+ </way>
+ <way id="11">
+  <nd ref="4"/>
+  <nd ref="3"/>
+  <tag k="highway" v="residential"/>
+  <tag k="oneway" v="-1"/>
+ </way>
+</osm>
+'''
+
+def test_binary_osm_format(tmp_path):
+    # converting to the binary format should give the same elements (and
+    # the same graph) as converting to serial pickles
+    import util
+    import graph
+    import osm_binary
+    for name in ('pickled', 'packed'):
+        with open(os.path.join(tmp_path, f'{name}.osm'), 'w', encoding='utf-8') as f:
+            f.write(SMALL_OSM)
+    util.osm_to_serial_pickles(os.path.join(tmp_path, 'pickled.osm'))
+    util.osm_to_serial_pickles(os.path.join(tmp_path, 'packed.osm'), binary=True)
+    maps = []
+    for name in ('pickled', 'packed'):
+        nodes_name = os.path.join(tmp_path, f'{name}.nodes')
+        ways_name = os.path.join(tmp_path, f'{name}.ways')
+        assert osm_binary.is_binary(nodes_name) == (name == 'packed')
+        maps.append(lab.build_internal_representation(nodes_name, ways_name))
+    for kind in ('nodes', 'ways'):
+        pickled = list(util.read_osm_data(os.path.join(tmp_path, f'pickled.{kind}')))
+        packed = list(util.read_osm_data(os.path.join(tmp_path, f'packed.{kind}')))
+        assert pickled == packed
+    assert packed[0] == {'id': 10, 'nodes': [1, 2, 3],
+                         'tags': {'highway': 'primary', 'maxspeed': '30 mph', 'maxspeed_mph': 30}}
+    for name, _ in graph.NODE_ARRAYS + graph.EDGE_ARRAYS:
+        assert maps[0][name] == maps[1][name]
+    with osm_binary.open_binary(os.path.join(tmp_path, 'packed.nodes')) as data:
+        assert list(data.columns['ids']) == [1, 2, 3, 4]
+        assert data.tags(1) == {'name': 'Lobby 7 – Massachusetts Ave'}
+
+
+def test_osm_conversion(tmp_path, monkeypatch):
+    # splitting the input into many small pieces, parsing them in worker
+    # processes, reading compressed input, or leaving out the line breaks
+    # between elements should not change the output
+    import re
+    import gzip
+    import util
+    monkeypatch.setattr(util, 'OSM_CHUNK_SIZE', 64)
+    osm = SMALL_OSM.replace('Lobby 7', 'Lobby 7 &amp; 10')
+    with open(os.path.join(tmp_path, 'serial.osm'), 'w', encoding='utf-8') as f:
+        f.write(osm)
+    with gzip.open(os.path.join(tmp_path, 'parallel.osm.gz'), 'wt', encoding='utf-8') as f:
+        f.write(osm)
+    with open(os.path.join(tmp_path, 'minified.osm'), 'w', encoding='utf-8') as f:
+        f.write(re.sub(r'>\s+<', '><', osm))
+    util.osm_to_serial_pickles(os.path.join(tmp_path, 'serial.osm'))
+    util.osm_to_serial_pickles(os.path.join(tmp_path, 'parallel.osm.gz'), processes=2)
+    util.osm_to_serial_pickles(os.path.join(tmp_path, 'minified.osm'))
+    results = {}
+    for name in ('serial', 'parallel', 'minified'):
+        results[name] = {
+            kind: list(util.read_osm_data(os.path.join(tmp_path, f'{name}.{kind}')))
+            for kind in ('bounds', 'nodes', 'ways')
+        }
+    assert results['serial'] == results['parallel'] == results['minified']
+    result = results['serial']
+    assert result['bounds'] == [{'minlat': 42.35, 'minlon': -71.11, 'maxlat': 42.37, 'maxlon': -71.09}]
+    assert [node['id'] for node in result['nodes']] == [1, 2, 3, 4]
+    assert result['nodes'][1]['tags'] == {'name': 'Lobby 7 & 10 – Massachusetts Ave'}
+    # oneway=-1 is turned into a one-way street in the order of its nodes
+    assert result['ways'][1] == {'id': 11, 'nodes': [3, 4], 'tags': {'highway': 'residential', 'oneway': 'yes'}}
+
+
+def test_reachable_nodes(tmp_path):
+    # a node should be reachable within the budget exactly when the fastest
+    # path to it takes no longer than that
+    import graph
+    import routing
+    import util
+    map_rep = lab.build_internal_representation(*make_grid_map(tmp_path))
+    loc = (42.355, -71.095)
+    source = graph.nearest_node(map_rep, loc)
+    reached = lab.find_reachable_nodes(map_rep, loc, 0.5)
+    assert reached[map_rep['ids'][source]] == 0
+    for target, node_id in enumerate(map_rep['ids']):
+        path = routing.find_path(map_rep, source, target, 'times')
+        minutes = None if path is None else 60 * path_cost(map_rep, [map_rep['ids'][i] for i in path], 'times')
+        if node_id in reached:
+            assert abs(reached[node_id] - minutes) <= 1e-9
+        else:
+            assert minutes is None or minutes > 0.5
+    locations = lab.find_reachable_locations(map_rep, loc, 0.5)
+    assert len(locations) == len(reached)
+    assert [minutes for _, minutes in locations] == sorted(reached.values())
+    assert util.to_kml_points([loc for loc, _ in locations]).count('<Point>') == len(reached)
+    hull = util.convex_hull([loc for loc, _ in locations])
+    assert set(hull) <= {loc for loc, _ in locations}
+    assert '<Polygon>' in util.to_kml_polygon([loc for loc, _ in locations])
+
+
+def test_way_speed_overrides(tmp_path):
+    # overriding the speeds of ways in place should give the same edge weights
+    # (and fast paths) as compiling the map with those speeds as speed limits,
+    # and removing the overrides should give back the original map
+    import random
+    import shutil
+    import routing
+    import traffic
+    import hierarchy
+    import landmarks
+    from util import read_osm_data
+    nodes_name, ways_name = make_grid_map(tmp_path)
+    ways = list(read_osm_data(ways_name))
+    # a way along part of another one, so that the two share an edge
+    ways.append({'id': 10 ** 6, 'nodes': ways[0]['nodes'][:2], 'tags': {'highway': 'residential'}})
+    with open(ways_name, 'wb') as f:
+        for way in ways:
+            pickle.dump(way, f)
+    map_rep = lab.build_internal_representation(nodes_name, ways_name)
+    original = list(map_rep['times'])
+    hierarchy.prepare_hierarchies(map_rep)
+    landmarks.prepare_landmarks(map_rep)
+
+    rng = random.Random(6009)
+    speeds = {way['id']: rng.choice([5, 20, 70]) for way in rng.sample(ways, 40)}
+    speeds[ways[0]['id']] = 1
+    speeds[10 ** 6] = 2
+    # the update works on a copy, leaving the old graph as it was
+    old_rep = dict(map_rep)
+    assert lab.update_way_speeds(map_rep, speeds) > 0
+    assert list(old_rep['times']) == original
+    assert 'times' in old_rep['hierarchies'] and landmarks.has_landmarks(old_rep, 'times')
+    assert 'times' not in map_rep['hierarchies'] and 'lengths' in map_rep['hierarchies']
+    assert not landmarks.has_landmarks(map_rep, 'times')
+    assert traffic.way_speed(map_rep, 10 ** 6) == 2
+
+    expected_dir = tmp_path / 'expected'
+    expected_dir.mkdir()
+    shutil.copy(nodes_name, expected_dir)
+    with open(expected_dir / 'grid.ways', 'wb') as f:
+        for way in ways:
+            if way['id'] in speeds:
+                way = dict(way, tags=dict(way['tags'], maxspeed_mph=speeds[way['id']]))
+            pickle.dump(way, f)
+    expected = lab.build_internal_representation(
+        str(expected_dir / 'grid.nodes'), str(expected_dir / 'grid.ways')
+    )
+    assert map_rep['speeds'] == expected['speeds']
+    assert map_rep['times'] == expected['times']
+    n = len(map_rep['ids'])
+    for _ in range(50):
+        source, target = rng.randrange(n), rng.randrange(n)
+        path = routing.find_path(map_rep, source, target, 'times')
+        expected_path = routing.find_path(expected, source, target, 'times', method='dijkstra')
+        assert (path is None) == (expected_path is None)
+        if path is not None:
+            ids = map_rep['ids']
+            assert round(path_cost(map_rep, [ids[i] for i in path], 'times'), 9) == \
+                round(path_cost(expected, [ids[i] for i in expected_path], 'times'), 9)
+
+    # a speed of 0 closes a way
+    revision = map_rep['revision']
+    closed = ways[5]['id']
+    assert lab.update_way_speeds(map_rep, {closed: 0}) > 0
+    assert map_rep['revision'] > revision
+    for e in traffic.way_edges(map_rep, closed):
+        assert map_rep['times'][e] == float('inf')
+    with pytest.raises(ValueError):
+        lab.update_way_speeds(map_rep, {closed: -1})
+
+    speeds[closed] = None
+    assert lab.update_way_speeds(map_rep, {way_id: None for way_id in speeds}) > 0
+    assert list(map_rep['times']) == original
+    assert lab.update_way_speeds(map_rep, {-1: 30}) == 0
+    assert traffic.way_speed(map_rep, -1) is None
+    assert -1 not in map_rep['speed_overrides']
+
+
+def load_server(directory, monkeypatch):
+    """
+    Import a fresh copy of the server module, serving a synthetic grid map
+    written to the given directory, and return it.
+    """
+    import sys
+    make_grid_map(directory)
+    monkeypatch.setattr(sys, 'argv', ['server.py', os.path.join(directory, 'grid')])
+    monkeypatch.delitem(sys.modules, 'server', raising=False)
+    import server
+    return server
+
+
+def server_request(server, path, params=None):
+    """
+    Send a request for the given path (with params as its JSON body) to the
+    server's WSGI application, and return the decoded JSON response.
+    """
+    import io
+    import json
+    body = json.dumps(params or {}).encode('utf-8')
+    environ = {'PATH_INFO': path, 'CONTENT_LENGTH': str(len(body)), 'wsgi.input': io.BytesIO(body)}
+    responses = []
+    result = server.application(environ, lambda status, headers: responses.append(status))
+    assert responses == ['200 OK']
+    return json.loads(b''.join(result))
+
+
+def route_params(server, source, target, kind='short'):
+    import graph
+    (lat1, lon1), (lat2, lon2) = (graph.node_location(server.MAP, i) for i in (source, target))
+    return {'startLat': lat1, 'startLon': lon1, 'endLat': lat2, 'endLon': lon2, 'type': kind}
+
+
+def test_server_route_cache(tmp_path, monkeypatch):
+    # the route cache should evict the least recently used route first, and
+    # /stats should count every hit, miss and latency
+    server = load_server(tmp_path, monkeypatch)
+    monkeypatch.setattr(server, 'ROUTE_CACHE_SIZE', 3)
+    n = len(server.MAP['ids'])
+    routes = [route_params(server, 0, target) for target in (n // 4, n // 2, 3 * n // 4, n - 1)]
+    for params in routes[:3]:
+        server_request(server, '/route', params)
+    # use the first route again, so that the second one is evicted instead
+    first = server_request(server, '/route', routes[0])
+    server_request(server, '/route', routes[3])
+    assert len(server.ROUTE_CACHE) == 3
+    assert server_request(server, '/route', routes[0]) == first
+    stats = server_request(server, '/stats')
+    assert (stats['hits'], stats['misses'], stats['cached_routes']) == (2, 4, 3)
+    server_request(server, '/route', routes[1])
+    stats = server_request(server, '/stats')
+    assert (stats['hits'], stats['misses']) == (2, 5)
+    assert stats['hit_rate'] == 2 / 7
+    latency = stats['latency_ms']
+    assert latency['count'] == 7
+    assert 0 <= latency['p50'] <= latency['p90'] <= latency['p99'] <= latency['max']
+
+
+def test_server_route_cache_revision(tmp_path, monkeypatch):
+    # after a /speeds update, fast routes should be found again under the new
+    # revision, while short routes (which do not depend on speeds) are reused
+    server = load_server(tmp_path, monkeypatch)
+    n = len(server.MAP['ids'])
+    fast = route_params(server, 0, n - 1, 'fast')
+    short = route_params(server, 0, n - 1, 'short')
+    server_request(server, '/route', fast)
+    server_request(server, '/route', short)
+    assert {key[3] for key in server.ROUTE_CACHE} == {0}
+    result = server_request(server, '/speeds', {'speeds': {'0': 1, '1': 1}})
+    assert result['ok'] and result['changed_edges'] > 0 and result['revision'] == 1
+    server_request(server, '/route', fast)
+    server_request(server, '/route', short)
+    stats = server_request(server, '/stats')
+    assert (stats['hits'], stats['misses'], stats['cached_routes']) == (1, 3, 3)
+    assert {key[3] for key in server.ROUTE_CACHE if key[2] == 'fast'} == {0, 1}
+    assert {key[3] for key in server.ROUTE_CACHE if key[2] == 'short'} == {0}
+
+
+def test_spatial_index():
+    # nearest-node, k-nearest and radius queries should agree with a linear
+    # scan, including for locations well outside the area covered by the nodes
+    import random
+    from array import array
+    import graph
+    from util import great_circle_distance
+    rng = random.Random(6009)
+    n = 500
+    map_rep = {
+        'ids': array('q', range(n)),
+        'lat': array('d', (42.35 + rng.random() * 0.03 for _ in range(n))),
+        'lon': array('d', (-71.11 + rng.random() * 0.05 for _ in range(n))),
+    }
+    for _ in range(100):
+        loc = (42.3 + rng.random() * 0.13, -71.15 + rng.random() * 0.13)
+        by_distance = sorted(
+            (great_circle_distance(loc, graph.node_location(map_rep, i)), i)
+            for i in range(n)
+        )
+        assert graph.nearest_node(map_rep, loc) == by_distance[0][1]
+        assert graph.nearest_nodes(map_rep, loc, 5) == [i for _, i in by_distance[:5]]
+        radius = rng.random() * 2
+        expected = [i for distance, i in by_distance if distance <= radius]
+        assert graph.nodes_within(map_rep, loc, radius) == expected
+
+
 if __name__ == "__main__":
     import os
     import sys
@@ -0,0 +1,162 @@
+"""
+Live speed changes for the compact graphs built by graph.py.
+
+Traffic feeds report the current speed on individual OSM ways.  Rather than
+rebuilding the graph, set_way_speeds overrides the speed limits of those ways
+in place, rewriting only the speeds and times of the edges they became.  The
+edge weights of every other way, and everything that only depends on
+distance, are left alone.
+
+Preprocessed accelerators for the 'times' metric are then repaired or dropped,
+so that the next fast path query sees the new speeds:
+    max_speed: raised if a way got faster than any edge so far (a top speed
+        that is too high still gives an admissible distance heuristic)
+    landmark tables: kept while travel times only go up, since costs under
+        the old times are still lower bounds; dropped once any edge gets
+        faster
+    contraction hierarchy: dropped whenever a travel time changes, since its
+        shortcuts have the old times built in (see hierarchy.prepare_hierarchies
+        to build a new one)
+
+Every change also bumps graph['revision'], so that anything caching results
+computed from the graph (such as the server's route cache) can tell them
+apart from results computed under other speeds.
+
+Nothing that a search might be reading is changed in place: the speeds and
+times arrays, the overrides and the accelerator tables are replaced by
+updated copies, each with a single assignment to the graph.  To update a
+graph that other threads are searching, apply the change to a shallow copy
+(dict(graph)) and then swap that in for the old one, as the server does; the
+old graph stays exactly as it was.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+
+INF = float('inf')
+
+
+def way_edges(graph, way_id):
+    """
+    Return the indices of the edges that the OSM way with the given id became
+    (empty if the way is not in the graph).
+    """
+    ids, offsets, edges = graph['way_ids'], graph['way_offsets'], graph['way_edges']
+    return [
+        edges[j]
+        for w in range(bisect_left(ids, way_id), bisect_right(ids, way_id))
+        for j in range(offsets[w], offsets[w + 1])
+    ]
+
+
+def edge_ways(graph):
+    """
+    Return the ways (as indices into the graph's way arrays) that each edge
+    came from, in CSR form, building them the first time they are needed: a
+    dictionary with
+        offsets: the ways of edge e are entries offsets[e] to offsets[e+1]-1
+            of ways
+        ways: way indices, grouped by edge
+    """
+    if 'edge_ways' not in graph:
+        way_offsets, way_edges = graph['way_offsets'], graph['way_edges']
+        m = len(graph['targets'])
+        offsets = array('q', bytes(8 * (m + 1)))
+        for e in way_edges:
+            offsets[e + 1] += 1
+        for e in range(m):
+            offsets[e + 1] += offsets[e]
+        ways = array('q', bytes(8 * len(way_edges)))
+        filled = array('q', offsets[:-1])
+        for w in range(len(way_offsets) - 1):
+            for j in range(way_offsets[w], way_offsets[w + 1]):
+                e = way_edges[j]
+                ways[filled[e]] = w
+                filled[e] += 1
+        graph['edge_ways'] = {'offsets': offsets, 'ways': ways}
+    return graph['edge_ways']
+
+
+def way_speed(graph, way_id):
+    """
+    Return the current speed (in miles per hour) of the OSM way with the given
+    id: its override if it has one, and its speed limit otherwise.  Returns
+    None if the way is not in the graph.
+    """
+    overrides = graph.get('speed_overrides', {})
+    if way_id in overrides:
+        return overrides[way_id]
+    ids = graph['way_ids']
+    w = bisect_left(ids, way_id)
+    if w < len(ids) and ids[w] == way_id:
+        return graph['way_speeds'][w]
+    return None
+
+
+def set_way_speeds(graph, speeds):
+    """
+    Override the speeds of OSM ways, replacing the graph's edge weight arrays
+    with updated copies (see above).
+
+    speeds maps way ids to their new speed in miles per hour (0 closes the
+    way), or to None to go back to the way's own speed limit.  Ways that are
+    not in the graph are ignored.  As when the graph was compiled, an edge
+    that several ways share gets the highest of their speeds.
+
+    Returns the number of edges whose speed changed.  Raises ValueError for a
+    negative speed, before changing anything.
+    """
+    for way_id, speed in speeds.items():
+        if speed is not None and speed < 0:
+            raise ValueError(f'negative speed for way {way_id}: {speed}')
+    overrides = dict(graph.get('speed_overrides', {}))
+    ids, base_speeds = graph['way_ids'], graph['way_speeds']
+    touched = set()
+    for way_id, speed in speeds.items():
+        edges = way_edges(graph, way_id)
+        if not edges:
+            continue
+        if speed is None:
+            overrides.pop(way_id, None)
+        else:
+            overrides[way_id] = speed
+        touched.update(edges)
+    graph['speed_overrides'] = overrides
+    if not touched:
+        return 0
+
+    shared = edge_ways(graph)
+    offsets, ways = shared['offsets'], shared['ways']
+    edge_speeds, times, lengths = graph['speeds'][:], graph['times'][:], graph['lengths']
+    changed = 0
+    faster = False
+    top_speed = 0.0
+    for e in touched:
+        speed = max(
+            overrides.get(ids[w], base_speeds[w]) for w in ways[offsets[e]:offsets[e + 1]]
+        )
+        if speed == edge_speeds[e]:
+            continue
+        changed += 1
+        faster = faster or speed > edge_speeds[e]
+        top_speed = max(top_speed, speed)
+        edge_speeds[e] = speed
+        times[e] = lengths[e] / speed if speed else INF
+    if not changed:
+        return 0
+
+    graph['speeds'] = edge_speeds
+    graph['times'] = times
+    if 'max_speed' in graph and top_speed > graph['max_speed']:
+        graph['max_speed'] = top_speed
+    if 'times' in graph.get('hierarchies', {}):
+        graph['hierarchies'] = {
+            metric: hierarchy for metric, hierarchy in graph['hierarchies'].items()
+            if metric != 'times'
+        }
+    if faster and 'landmarks' in graph:
+        graph['landmarks'] = {
+            name: table for name, table in graph['landmarks'].items()
+            if not name.startswith('times.')
+        }
+    graph['revision'] = graph.get('revision', 0) + 1
+    return changed
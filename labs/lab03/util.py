@@ -1,12 +1,19 @@
 import re
 import bz2
 import gzip
+import queue
 import base64
 import pickle
+import threading
+import collections
 import urllib.parse
+import multiprocessing
+import xml.parsers.expat
 
 from math import acos,cos,sin,pi,atan2
 
+from osm_binary import BinaryWriter, is_binary, open_binary
+
 
 def great_circle_distance(loc1, loc2):
     """
@@ -66,6 +73,75 @@ def to_kml(path):
 </kml>""" % ((path[0][::-1]) + (path[-1][::-1])))
 
 
+def convex_hull(locs):
+    """
+    Given a list of (latitude, longitude) tuples, return the corners of their
+    convex hull (treating coordinates as planar, which is fine at city
+    scale), in counterclockwise order.
+    """
+    points = sorted(set(locs))
+    if len(points) <= 2:
+        return points
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+    lower, upper = [], []
+    for p in points:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    for p in reversed(points):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+    return lower[:-1] + upper[:-1]
+
+
+def to_kml_points(locs, name='Reachable'):
+    """
+    Given a list of (latitude, longitude) tuples, return a string containing a
+    KML representation of them as a cloud of points, e.g. the nodes found by
+    lab.find_reachable_nodes.
+    """
+    placemarks = "".join("""
+    <Placemark>
+      <name>%s</name>
+      <Point>
+        <coordinates>%f,%f,0</coordinates>
+      </Point>
+    </Placemark>""" % ((name,) + tuple(loc[::-1])) for loc in locs)
+    return ("""<?xml version="1.0" encoding="utf-8"?>
+<kml xmlns="http://earth.google.com/kml/2.1">
+  <Document>%s
+  </Document>
+</kml>""" % placemarks)
+
+
+def to_kml_polygon(locs, name='Reachable area'):
+    """
+    Given a list of (latitude, longitude) tuples, return a string containing a
+    KML representation of the polygon around them (their convex hull), e.g.
+    an isochrone from lab.find_reachable_locations.
+    """
+    ring = convex_hull(locs)
+    ring = ring + ring[:1]
+    return ("""<?xml version="1.0" encoding="utf-8"?>
+<kml xmlns="http://earth.google.com/kml/2.1">
+  <Document>
+    <Placemark>
+      <name>%s</name>
+      <Polygon>
+        <tessellate>1</tessellate>
+        <outerBoundaryIs>
+          <LinearRing>
+            <coordinates>%s</coordinates>
+          </LinearRing>
+        </outerBoundaryIs>
+      </Polygon>
+    </Placemark>
+  </Document>
+</kml>""" % (name, " ".join("%f,%f" % (loc[::-1]) for loc in ring)))
+
+
 def to_local_kml_url(path):
     """
     Given a path as a list of (latitude, longitude) tuples, return a string
@@ -77,6 +153,16 @@ def to_local_kml_url(path):
     return 'http://localhost:6009/?%s' % qstring
 
 
+def percentile(values, fraction):
+    """
+    Return the given fraction's percentile of a sorted list of values (by the
+    nearest-rank method), or None if it is empty.
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
 def read_osm_data(filename):
     """
     Yield elements from the given filename, which is assumed to contain a
@@ -90,8 +176,16 @@ def read_osm_data(filename):
         for element in read_osm_data('some_file'):
             print(element)
 
+    Files in the packed binary format written by osm_to_serial_pickles with
+    binary=True (see osm_binary.py) are read too, and yield the same
+    elements.
+
     [1] see https://docs.python.org/3/library/pickle.html
     """
+    if is_binary(filename):
+        with open_binary(filename) as data:
+            yield from data
+        return
     with open(filename, 'rb') as f:
         while True:
             try:
@@ -100,7 +194,155 @@ def read_osm_data(filename):
                 break
 
 
-def osm_to_serial_pickles(filename):
+# top-level elements of an OSM XML file, which the converter may split at (a
+# '<' can only start a tag, so this also works without line breaks between
+# the elements, as in minified files)
+OSM_ELEMENT_START = re.compile(rb'<(?:bounds|node|way|relation|changeset)\b')
+OSM_CHUNK_SIZE = 1 << 22
+OSM_BLOCK_SIZE = 1 << 20
+
+
+def _read_blocks(input_file, blocks):
+    """
+    Decompression thread: read (and decompress) the input file block by
+    block into the bounded queue blocks, ending with None.  An exception is
+    passed along in place of a block.
+    """
+    try:
+        for block in iter(lambda: input_file.read(OSM_BLOCK_SIZE), b''):
+            blocks.put(block)
+        blocks.put(None)
+    except BaseException as e:
+        blocks.put(e)
+
+
+def _osm_chunks(input_file):
+    """
+    Yield pieces of the given (binary) OSM XML file, each made of whole
+    top-level elements and about OSM_CHUNK_SIZE bytes long, without the XML
+    declaration and the enclosing <osm> element.
+
+    The file is read by a separate thread, so that decompressing it overlaps
+    with parsing.
+    """
+    blocks = queue.Queue(maxsize=8)
+    reader = threading.Thread(target=_read_blocks, args=(input_file, blocks), daemon=True)
+    reader.start()
+    pending = b''
+    started = False
+    while True:
+        block = blocks.get()
+        if isinstance(block, BaseException):
+            raise block
+        if block is not None:
+            pending += block
+            if len(pending) < OSM_CHUNK_SIZE:
+                continue
+        if not started:
+            # drop everything before the first element (the XML declaration
+            # and the opening <osm> tag)
+            first = OSM_ELEMENT_START.search(pending)
+            if first is None:
+                if block is None:
+                    break
+                continue
+            pending = pending[first.start():]
+            started = True
+        if block is None:
+            end = pending.rfind(b'</osm>')
+            yield pending if end == -1 else pending[:end]
+            break
+        # cut before the last element that starts in the buffer, which may
+        # not be complete yet
+        cut = None
+        for cut in OSM_ELEMENT_START.finditer(pending, 1):
+            pass
+        if cut is not None:
+            yield pending[:cut.start()]
+            pending = pending[cut.start():]
+    reader.join()
+
+
+def _finish_way(way):
+    """
+    Normalize the tags of a way once all of its nodes and tags are known.
+    """
+    tags = way['tags']
+    if tags.get('oneway') == 'reversible':
+        # one-way roads whose directions change with time?  let's just assume
+        # the order is correct...
+        tags['oneway'] = 'yes'
+    elif tags.get('oneway') == '-1':
+        # one-way, but in the other direction
+        tags['oneway'] = 'yes'
+        way['nodes'] = way['nodes'][::-1]
+    # try to do some conversion of speed limits so we get an integer value in
+    # the resulting object
+    for tagname in ('maxspeed', 'maxspeed:advisory'):
+        if tagname in tags:
+            try:
+                tags['maxspeed_mph'] = int(tags[tagname].split()[0])
+                break
+            except:
+                pass
+    return way
+
+
+def _parse_osm_chunk(chunk, pickled=False):
+    """
+    Parse a piece of OSM XML from _osm_chunks, feeding it to an expat parser
+    block by block, and return lists of the bounds, nodes and ways in it.  If
+    pickled is True, the nodes and ways are returned as serial pickle data
+    instead.
+
+    Only the element being read is kept in memory besides the results; no
+    document tree is built.
+    """
+    bounds, nodes, ways = [], [], []
+    current = None
+
+    def start_element(name, attrs):
+        nonlocal current
+        if name == 'nd':
+            if current is not None and 'nodes' in current:
+                current['nodes'].append(int(attrs['ref']))
+        elif name == 'tag':
+            if current is not None:
+                current['tags'][attrs['k']] = attrs['v']
+        elif name == 'node':
+            current = {'id': int(attrs['id']), 'lat': float(attrs['lat']),
+                       'lon': float(attrs['lon']), 'tags': {}}
+        elif name == 'way':
+            current = {'id': int(attrs['id']), 'nodes': [], 'tags': {}}
+        elif name == 'bounds':
+            keys = ('minlat', 'minlon', 'maxlat', 'maxlon')
+            bounds.append({key: float(attrs[key]) for key in keys})
+        elif name in ('relation', 'changeset'):
+            current = None
+
+    def end_element(name):
+        nonlocal current
+        if name == 'node':
+            nodes.append(current)
+            current = None
+        elif name == 'way':
+            ways.append(_finish_way(current))
+            current = None
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.Parse(b'<osm>', False)
+    for start in range(0, len(chunk), OSM_BLOCK_SIZE):
+        parser.Parse(chunk[start:start + OSM_BLOCK_SIZE], False)
+    parser.Parse(b'</osm>', True)
+    if pickled:
+        nodes = b''.join(pickle.dumps(node) for node in nodes)
+        ways = b''.join(pickle.dumps(way) for way in ways)
+    return bounds, nodes, ways
+
+
+def osm_to_serial_pickles(filename, binary=False, processes=1):
     """
     Convert the data from the given filename (assumed to represent a raw OSM
     data file, in OSM XML format[1]) to the serial pickle format used in 6.009
@@ -114,10 +356,12 @@ def osm_to_serial_pickles(filename):
     Downloading raw data from [2] or [3] will usually provide files that have
     been compressed using gzip or bz2.
 
-    It is worth mentioning that this may not work in a general sense (because
-    it assumes structure that may not hold true, such as the ordering of some
-    attributes), though it seems to work on data from the two sources listed
-    here, and also from direct exports from [4].
+    The file is streamed through an incremental (expat) XML parser: a
+    separate thread reads (and decompresses) it, and it is split into pieces at the
+    boundaries between top-level elements, so memory use does not grow with
+    the size of the file.  If processes is more than 1, that many worker
+    processes parse the pieces in parallel, and their output is written in
+    the original order.
 
     Example usage:
         osm_to_serial_pickles('resources/cambridge.osm')
@@ -127,20 +371,15 @@ def osm_to_serial_pickles(filename):
         resources/cambridge.ways
         resources/cambridge.bounds
 
+    If binary is True, the .nodes and .ways files are written in the packed
+    binary format of osm_binary.py instead, which read_osm_data also accepts
+    and which can be memory-mapped with osm_binary.open_binary.
+
     [1] see https://wiki.openstreetmap.org/wiki/OSM_XML
     [2] https://download.geofabrik.de/
     [3] https://download.bbbike.org/osm/
     [4] https://www.openstreetmap.org/export
     """
-    node_start = re.compile(r'\s*<node.*?id="(\d+)".*?lat="(-?\d+\.?\d*)".*?lon="(-?\d+\.?\d*)".*?(/?)>')
-    node_end = re.compile(r'\s*</node>')
-    way_start = re.compile(r'\s*<way.*?id="(\d+)".*?>')
-    way_node = re.compile(r'\s*<nd ref="(\d+)".*?/>')
-    way_end = re.compile(r'\s*</way>')
-    inline_tag = re.compile(r'\s*<tag.*?k="(.*?)".*?v="(.*?)".*?/>')
-    bounds = re.compile(r'\s*<bounds.*?minlat="(-?\d+\.?\d*)".*?minlon="(-?\d+\.?\d*)".*?maxlat="(-?\d+\.?\d*)".*?maxlon="(-?\d+\.?\d*)".*?/>')
-
-
     # check the file extension and open the file
     filename_checker = re.compile(r'^(.*)\.((?:osm|xml)(?:.(?:gz|bz2))?)$')
     filename_match = filename_checker.match(filename)
@@ -150,82 +389,60 @@ def osm_to_serial_pickles(filename):
         raise ValueError('filename should end in .gz, .bz2, .xml or .osm')
 
     if extension.endswith('.gz'):
-        input_file = gzip.open(filename, 'rt', encoding='utf-8')
+        input_file = gzip.open(filename, 'rb')
     elif extension.endswith('.bz2'):
-        input_file = bz2.open(filename, 'rt', encoding='utf-8')
+        input_file = bz2.open(filename, 'rb')
     else:
-        input_file = open(filename, 'r', encoding='utf-8')
+        input_file = open(filename, 'rb')
 
     bounds_file = open(f'{basename}.bounds', 'wb')
-    nodes_file = open(f'{basename}.nodes', 'wb')
-    ways_file = open(f'{basename}.ways', 'wb')
+    if binary:
+        nodes_file = BinaryWriter(f'{basename}.nodes', 'nodes')
+        ways_file = BinaryWriter(f'{basename}.ways', 'ways')
+    else:
+        nodes_file = open(f'{basename}.nodes', 'wb')
+        ways_file = open(f'{basename}.ways', 'wb')
+
+    def write(result):
+        bounds, nodes, ways = result
+        for bounds_obj in bounds:
+            pickle.dump(bounds_obj, bounds_file)
+        if binary:
+            for node in nodes:
+                nodes_file.write(node)
+            for way in ways:
+                ways_file.write(way)
+        else:
+            nodes_file.write(nodes)
+            ways_file.write(ways)
 
     try:
-        current_node = None
-        current_way = None
-        for line in iter(input_file.readline, ''):
-            if current_node is not None:
-                # look for tags or ending nodes
-                tag_match = inline_tag.match(line)
-                if tag_match:
-                    g = tag_match.groups()
-                    current_node['tags'][g[0]] = g[1]
-                if node_end.match(line):
-                    pickle.dump(current_node, nodes_file)
-                    current_node = None
-            elif current_way is not None:
-                # look for nodes and tags, or ending way
-                tag_match = inline_tag.match(line)
-                if tag_match:
-                    key, value = tag_match.groups()
-                    if key == 'oneway':
-                        if value == 'reversible':
-                            # one-way roads whose directions change with time?
-                            # let's just assume the order is correct...
-                            value = 'yes'
-                        elif value == '-1':
-                            # one-way, but in the other direction
-                            value = 'yes'
-                            current_way['nodes'] = current_way['nodes'][::-1]
-                    current_way['tags'][key] = value
-                nd_match = way_node.match(line)
-                if nd_match:
-                    current_way['nodes'].append(int(nd_match.group(1)))
-                if way_end.match(line):
-                    # try to do some conversion of speed limits so we get an
-                    # integer value in the resulting object
-                    for tagname in ('maxspeed', 'maxspeed:advisory'):
-                        if tagname in current_way['tags']:
-                            try:
-                                current_way['tags']['maxspeed_mph'] = int(current_way['tags'][tagname].split()[0])
-                                break
-                            except:
-                                pass
-                    pickle.dump(current_way, ways_file)
-                    current_way = None
-            else:
-                m1 = node_start.match(line)
-                if m1:
-                    g = m1.groups()
-                    node = {'id': int(g[0]), 'lat': float(g[1]), 'lon': float(g[2]), 'tags': {}}
-                    if g[3] != '/':
-                        current_node = node
-                    else:
-                        pickle.dump(node, nodes_file)
-                else:
-                    m2 = way_start.match(line)
-                    if m2:
-                        g = m2.groups()
-                        current_way = {'id': int(g[0]), 'nodes': [], 'tags': {}}
-                    else:
-                        b = bounds.match(line)
-                        if b:
-                            keys = ('minlat', 'minlon', 'maxlat', 'maxlon')
-                            bounds_obj = dict(zip(keys, (float(i) for i in b.groups())))
-                            pickle.dump(bounds_obj, bounds_file)
+        chunks = _osm_chunks(input_file)
+        if processes <= 1:
+            for chunk in chunks:
+                write(_parse_osm_chunk(chunk, not binary))
+        else:
+            with multiprocessing.Pool(processes) as pool:
+                # keep a bounded number of pieces in flight, and write their
+                # results in order
+                in_flight = collections.deque()
+                for chunk in chunks:
+                    in_flight.append(pool.apply_async(_parse_osm_chunk, (chunk, not binary)))
+                    if len(in_flight) >= 2 * processes:
+                        write(in_flight.popleft().get())
+                while in_flight:
+                    write(in_flight.popleft().get())
     except:
+        if binary:
+            nodes_file.discard()
+            ways_file.discard()
         raise
     finally:
-        for f in (input_file, nodes_file, ways_file, bounds_file):
+        for f in (input_file, bounds_file):
             f.close()
-
+        if not binary:
+            nodes_file.close()
+            ways_file.close()
+    if binary:
+        nodes_file.close()
+        ways_file.close()
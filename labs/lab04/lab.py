@@ -23,6 +23,93 @@ def dump(game):
 # 2-D IMPLEMENTATION
 
 
+def nested_list(dimensions, value):
+    """
+    Return an N-dimensional array (nested lists) of the given dimensions, with
+    every cell set to value.
+
+    >>> nested_list((2, 3), False)
+    [[False, False, False], [False, False, False]]
+    """
+    if len(dimensions) == 1:
+        return [value] * dimensions[0]
+    return [nested_list(dimensions[1:], value) for _ in range(dimensions[0])]
+
+
+def new_board(dimensions, bombs):
+    """
+    Return the board (nested lists) of a game with the given dimensions and
+    bombs: '.' for each bomb, and the number of neighboring bombs for every
+    other cell.  Bombs outside the board are ignored.
+
+    Rather than checking the neighbors of every cell, each bomb adds one to
+    the count of each of its neighbors, so the work grows with the number of
+    bombs (times 3**N) rather than with the size of the board.  The counts
+    are kept in a flat list over the board with a one-cell border all around,
+    so that the neighbors of every bomb are a fixed set of offsets from it,
+    with no bounds checks; the border is dropped when the list is cut back
+    into nested rows.
+
+    >>> new_board((2, 4), [(0, 0), (1, 0), (1, 1)])
+    [['.', 3, 1, 0], ['.', '.', 1, 0]]
+    """
+    padded = [size + 2 for size in dimensions]
+    strides = [1] * len(dimensions)
+    for axis in range(len(dimensions) - 2, -1, -1):
+        strides[axis] = strides[axis + 1] * padded[axis + 1]
+    neighbors = [0]
+    for stride in strides:
+        neighbors = [offset + step * stride for offset in neighbors for step in (-1, 0, 1)]
+
+    # flat index of every bomb, as a set so repeated bombs only count once
+    bomb_cells = set()
+    for bomb in bombs:
+        cell = sum(strides)
+        for coordinate, size, stride in zip(bomb, dimensions, strides):
+            if not 0 <= coordinate < size:
+                break
+            cell += coordinate * stride
+        else:
+            bomb_cells.add(cell)
+
+    counts = [0] * (strides[0] * padded[0])
+    for offset in neighbors:
+        for cell in bomb_cells:
+            counts[cell + offset] += 1
+    for cell in bomb_cells:
+        counts[cell] = '.'
+
+    def unflatten(start, axis):
+        if axis == len(dimensions) - 1:
+            return counts[start + 1:start + 1 + dimensions[axis]]
+        return [
+            unflatten(start + (i + 1) * strides[axis], axis + 1)
+            for i in range(dimensions[axis])
+        ]
+
+    return unflatten(0, 0)
+
+
+def new_game(dimensions, bombs):
+    """
+    Return the game state dictionary for a new game with the given dimensions
+    and bombs (shared by new_game_2d and new_game_nd).
+
+    >>> dump(new_game((1, 3), [(0, 2)]))
+    board:
+        [0, 1, '.']
+    dimensions: (1, 3)
+    state: ongoing
+    visible:
+        [False, False, False]
+    """
+    return {
+        'dimensions': dimensions,
+        'board': new_board(dimensions, bombs),
+        'visible': nested_list(dimensions, False),
+        'state': 'ongoing'}
+
+
 def new_game_2d(num_rows, num_cols, bombs):
     """
     Start a new game.
@@ -49,67 +136,7 @@ def new_game_2d(num_rows, num_cols, bombs):
         [False, False, False, False]
         [False, False, False, False]
     """
-    board = []
-    for r in range(num_rows):
-        row = []
-        for c in range(num_cols):
-            if [r, c] in bombs or (r, c) in bombs:
-                row.append('.')
-            else:
-                row.append(0)
-        board.append(row)
-    visible = []
-    for r in range(num_rows):
-        row = []
-        for c in range(num_cols):
-            row.append(False)
-        visible.append(row)
-    for r in range(num_rows):
-        for c in range(num_cols):
-            if board[r][c] == 0:
-                neighbor_bombs = 0
-                if 0 <= r-1 < num_rows:
-                    if 0 <= c-1 < num_cols:
-                        if board[r-1][c-1] == '.':
-                            neighbor_bombs += 1
-                if 0 <= r < num_rows:
-                    if 0 <= c-1 < num_cols:
-                        if board[r][c-1] == '.':
-                            neighbor_bombs += 1
-                if 0 <= r+1 < num_rows:
-                    if 0 <= c-1 < num_cols:
-                        if board[r+1][c-1] == '.':
-                            neighbor_bombs += 1
-                if 0 <= r-1 < num_rows:
-                    if 0 <= c < num_cols:
-                        if board[r-1][c] == '.':
-                            neighbor_bombs += 1
-                if 0 <= r < num_rows:
-                    if 0 <= c < num_cols:
-                        if board[r][c] == '.':
-                            neighbor_bombs += 1
-                if 0 <= r+1 < num_rows:
-                    if 0 <= c < num_cols:
-                        if board[r+1][c] == '.':
-                            neighbor_bombs += 1
-                if 0 <= r-1 < num_rows:
-                    if 0 <= c+1 < num_cols:
-                        if board[r-1][c+1] == '.':
-                            neighbor_bombs += 1
-                if 0 <= r < num_rows:
-                    if 0 <= c+1 < num_cols:
-                        if board[r][c+1] == '.':
-                            neighbor_bombs += 1
-                if 0 <= r+1 < num_rows:
-                    if 0 <= c+1 < num_cols:
-                        if board[r+1][c+1] == '.':
-                            neighbor_bombs += 1
-                board[r][c] = neighbor_bombs
-    return {
-        'dimensions': (num_rows, num_cols),
-        'board': board,
-        'visible': visible,
-        'state': 'ongoing'}
+    return new_game((num_rows, num_cols), bombs)
 
 
 def dig_2d(game, row, col):
@@ -369,7 +396,7 @@ def new_game_nd(dimensions, bombs):
         [[False, False], [False, False], [False, False], [False, False]]
         [[False, False], [False, False], [False, False], [False, False]]
     """
-    raise NotImplementedError
+    return new_game(dimensions, bombs)
 
 
 def dig_nd(game, coordinates):
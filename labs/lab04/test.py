@@ -144,6 +144,34 @@ def test_2d_integration():
         _do_test_2d_integration(testnum)
 
 
+def test_new_game_counts():
+    """ Checking boards against counting the neighbors of every cell """
+    import random
+    rng = random.Random(6009)
+    for dimensions in [(1, 1), (1, 7), (6, 5), (3, 4, 5), (2, 3, 2, 3)]:
+        cells = [()]
+        for size in dimensions:
+            cells = [cell + (i,) for cell in cells for i in range(size)]
+        bombs = rng.sample(cells, len(cells) // 4)
+        # repeated bombs, and bombs given as lists, are the same bombs
+        bombs += [list(bomb) for bomb in bombs[:3]]
+        bomb_set = {tuple(bomb) for bomb in bombs}
+        if len(dimensions) == 2:
+            board = lab.new_game_2d(*dimensions, bombs)['board']
+        else:
+            board = lab.new_game_nd(dimensions, bombs)['board']
+        for cell in cells:
+            value = board
+            for i in cell:
+                value = value[i]
+            if cell in bomb_set:
+                assert value == '.'
+            else:
+                assert value == sum(
+                    all(abs(a - b) <= 1 for a, b in zip(cell, bomb)) for bomb in bomb_set
+                )
+
+
 def test_newsmall6dgame():
     """ Testing new_game on a small 6-D board """
     exp_fname = os.path.join(TEST_DIRECTORY, 'test_outputs', 'testnd_newsmall6dgame.pickle')